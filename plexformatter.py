@@ -1,11 +1,39 @@
 import os
+import re
 import shutil
 import logging
 import logging.handlers
 import time
 import signal
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+import heapq
+import threading
+import hashlib
+import enum
+import errno
+import queue
+import copy
+import itertools
+import bisect
+from collections import OrderedDict, deque
+
+# watchdog, sqlite3, asyncio, http.server and the executors are imported where they are first needed,
+# so parsing file names with FileFormatter stays a cheap import
+
+SYMBOL_PATTERN = re.compile(r'[\W_]')
+SEPARATOR_PATTERN = re.compile(r'[\W_]+')
+# name.rar / name.part01.rar / name.r00 and name.zip, the first volume is the one archives are opened with,
+# split zips (name.z01) are left out because zipfile cannot read them
+ARCHIVE_PATTERN = re.compile(r'^(?P<base>.+?)(?:\.part(?P<part>\d+))?\.(?P<extension>rar|zip|r\d\d)$', re.IGNORECASE)
+
+# WatchRoot Class
+class WatchRoot():
+    def __init__(self, watch_directory: str, **overrides):
+        # overrides replace any FormatterConfig setting for files found under this root
+        self.watch_directory = watch_directory
+        self.overrides = overrides
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, WatchRoot) and (self.watch_directory, self.overrides) == (other.watch_directory, other.overrides)
 
 # Config Class
 class FormatterConfig:
@@ -23,41 +51,504 @@ class FormatterConfig:
             'av1', 'x264', 'hdtv', 'bluray', 'bdrip', 'dvdrip', 'brrip',
             '4k', '2160', '2160p', '1080', '1080p', '720', '720p',
             'webrip', 'amzn', 'h264', 'hevc', 'h', '264' ,'265' ,'h265',
-            'proper', 'remastered', 'theatrical', 'rarbg'
+            'proper', 'remastered', 'theatrical', 'rarbg', 'web dl',
+            'dts hd ma'
         ]
         self.watch_directory = '/path/to/watch'
+        self.watch_roots = []
         self.show_destination_directory = '/path/to/destination'
         self.movie_destination_directory = '/path/to/destination'
         self.misc_destination_directory = '/path/to/destination'
         self.non_video_destination_directory = '/path/to/destination'
         self.log_level = logging.INFO
         self.log_location = '/path/to/destination'
+        self.parse_cache_size = 4096
+        self.parse_cache_location = None
+        self.journal_location = None
+        self.journal_sync_interval = 5
+        self.move_workers = 4
+        self.moves_per_device = 2
+        self.move_retries = 3
+        self.move_retry_delay = 5
+        self.sweep_rescan_interval = 300
+        self.event_window = 0.5
+        self.completion_detector = 'stability'
+        self.delay_before_moving = 60
+        self.stability_quiet_time = 60
+        self.stability_min_interval = 1
+        self.stability_max_interval = 10
+        self.check_open_handles = False
+        self.use_close_events = True
+        self.metrics_address = '127.0.0.1'
+        self.metrics_port = None
+        self.metrics_file = None
+        self.metrics_dump_interval = 15
+        self.runtime = 'threaded'
+        self.transfer_mode = 'move'
+        self.transfer_chunk_size = 64 * 1024 * 1024
+        self.transfer_rate_limit = 0
+        self.transfer_rate_profiles = []
+        self.small_file_size = 4 * 1024 * 1024 * 1024
+        self.extract_archives = True
+        self.extraction_workers = 1
+        self.duplicate_policy = 'replace'
+        self.library_index_location = None
+        self.fingerprint_block_size = 1024 * 1024
+        self.config_file = None
+        self.config_check_interval = 2
+
+    def update(self, values: dict):
+        for name, value in values.items():
+            if name.startswith('_') or not hasattr(self, name):
+                raise ValueError(f'unknown setting {name}')
+            if name == 'watch_roots':
+                value = [WatchRoot(**root) for root in value]
+            elif name == 'log_level' and isinstance(value, str):
+                value = logging.getLevelName(value.upper())
+                if not isinstance(value, int):
+                    raise ValueError(f'unknown log level {values[name]}')
+            setattr(self, name, value)
+
+    def root_configs(self) -> list['FormatterConfig']:
+        if not self.watch_roots:
+            return [self]
+        configs = []
+        for root in self.watch_roots:
+            config = copy.copy(self)
+            config.watch_roots = []
+            config.watch_directory = root.watch_directory
+            for name, value in root.overrides.items():
+                if not hasattr(config, name):
+                    raise AttributeError(f'unknown setting {name} for watch root {root.watch_directory}')
+                setattr(config, name, value)
+            configs.append(config)
+        return configs
+
+    def destination_directories(self) -> list[str]:
+        return [self.show_destination_directory, self.movie_destination_directory,
+                self.misc_destination_directory, self.non_video_destination_directory]
+
+def load_config(path: str) -> FormatterConfig:
+    import tomllib
+    with open(path, 'rb') as file:
+        values = tomllib.load(file)
+    config = FormatterConfig()
+    config.update(values)
+    config.config_file = path
+    config.root_configs()
+    return config
+
+# ConfigWatcher Class
+class ConfigWatcher():
+    def __init__(self, path: str, logger: logging.Logger, interval: float = 2):
+        self.path = path
+        self.logger = logger
+        self.interval = interval
+        self.last_check = time.time()
+        self.signature = self.stat()
+
+    def stat(self) -> tuple:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def poll(self, force: bool = False) -> FormatterConfig:
+        # returns the new configuration once the file changed, a broken file keeps the current one
+        current_time = time.time()
+        if not force and current_time - self.last_check < self.interval:
+            return None
+        self.last_check = current_time
+        signature = self.stat()
+        if signature is None or signature == self.signature:
+            return None
+        self.signature = signature
+        try:
+            return load_config(self.path)
+        except (OSError, ValueError, TypeError, AttributeError) as error:
+            self.logger.error(f"Cannot reload {self.path}, keeping the current configuration: {error}")
+            return None
+
+# Histogram Class
+class Histogram():
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+# Metrics Class
+class Metrics():
+    latency_buckets = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.01, 0.1)
+    duration_buckets = (0.001, 0.01, 0.1, 0.5, 1, 5, 30, 60, 300, 1800)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def describe(self, name: str, metric_type: str, description: str):
+        self.descriptions[name] = (metric_type, description)
+
+    def counter(self, name: str, description: str):
+        with self.lock:
+            self.describe(name, 'counter', description)
+            self.counters.setdefault(name, [0])
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name][0] += value
+
+    def register(self, metric_type: str, name: str, description: str, function):
+        # callback metrics are read when rendered, several daemons can report into the same name
+        with self.lock:
+            self.describe(name, metric_type, description)
+            values = self.counters if metric_type == 'counter' else self.gauges
+            values.setdefault(name, []).append(function)
+
+    def unregister(self, name: str, function):
+        with self.lock:
+            for values in (self.counters, self.gauges):
+                if function in values.get(name, []):
+                    values[name].remove(function)
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...]) -> Histogram:
+        with self.lock:
+            self.describe(name, 'histogram', description)
+            return self.histograms.setdefault(name, Histogram(buckets))
+
+    def observe(self, name: str, value: float):
+        self.histograms[name].observe(value)
+
+    def value(self, values: list) -> float:
+        return sum(value() if callable(value) else value for value in values)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (metric_type, description) in sorted(self.descriptions.items()):
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                if metric_type == 'histogram':
+                    histogram = self.histograms[name]
+                    with histogram.lock:
+                        counts = list(histogram.counts)
+                    cumulative = 0
+                    for bucket, count in zip(histogram.buckets + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{le="{bucket}"}} {cumulative}')
+                    lines.append(f'{name}_sum {histogram.sum}')
+                    lines.append(f'{name}_count {histogram.count}')
+                else:
+                    values = self.counters[name] if metric_type == 'counter' else self.gauges[name]
+                    lines.append(f'{name} {self.value(values)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(self.render())
+        os.replace(temporary_path, path)
+
+METRICS = Metrics()
+PARSE_SECONDS = METRICS.histogram('plexformatter_parse_filename_seconds', 'Time spent parsing a file name.',
+                                  Metrics.latency_buckets)
+DESTINATION_SECONDS = METRICS.histogram('plexformatter_create_destination_path_seconds', 'Time spent building a destination path.',
+                                        Metrics.latency_buckets)
+METRICS.histogram('plexformatter_move_seconds', 'Duration of finished moves.', Metrics.duration_buckets)
+METRICS.histogram('plexformatter_sweep_seconds', 'Time spent cleaning the watch folder.', Metrics.latency_buckets + Metrics.duration_buckets[3:])
+METRICS.counter('plexformatter_moved_bytes_total', 'Bytes moved into the library.')
+METRICS.counter('plexformatter_moves_total', 'Files moved into the library.')
+METRICS.counter('plexformatter_move_failures_total', 'Moves that failed after all retries.')
+
+# MetricsServer Class
+class MetricsServer():
+    def __init__(self, metrics: Metrics, address: str, port: int):
+        import http.server
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                body = metrics.render().encode()
+                handler.send_response(200 if handler.path in ('/', '/metrics') else 404)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='plexformatter-metrics', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# CompiledLookups Class
+class CompiledLookups():
+    def __init__(self, config: FormatterConfig):
+        self.extensions = frozenset(extension.lower() for extension in config.extensions)
+        self.extensions_to_delete = frozenset(extension.lower() for extension in config.extensions_to_delete)
+        tags = set()
+        self.tag_trie = {}
+        for tag in config.tags:
+            tokens = [token for token in SEPARATOR_PATTERN.split(tag.lower()) if token]
+            if not tokens:
+                continue
+            tags.add(' '.join(tokens))
+            if len(tokens) > 1:
+                node = self.tag_trie
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                node[None] = True
+        self.tags = frozenset(tags)
+        self.show_destination_directory = config.show_destination_directory
+        self.movie_destination_directory = config.movie_destination_directory
+        self.misc_destination_directory = config.misc_destination_directory
+        self.non_video_destination_directory = config.non_video_destination_directory
+        self.fingerprint = self.create_fingerprint(config)
+
+    def create_fingerprint(self, config: FormatterConfig) -> str:
+        # any change to a value that affects parsing or routing produces a new cache namespace
+        source = repr((sorted(self.tags), sorted(self.extensions), sorted(self.extensions_to_delete),
+                       config.show_destination_directory, config.movie_destination_directory,
+                       config.misc_destination_directory, config.non_video_destination_directory))
+        return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+    def destination_directories(self) -> list[str]:
+        return [self.show_destination_directory, self.movie_destination_directory,
+                self.misc_destination_directory, self.non_video_destination_directory]
+
+    def migration(self, lookups: 'CompiledLookups'):
+        # returns a function that carries a cached result over to the new lookups, or None when it has to be parsed again
+        changed_tokens = frozenset(tag.split(' ')[0] for tag in self.tags ^ lookups.tags)
+        changed_extensions = (self.extensions ^ lookups.extensions) | (self.extensions_to_delete ^ lookups.extensions_to_delete)
+        old_directories = [os.path.join(directory, '') for directory in self.destination_directories()]
+        moved = []
+        for index, new in enumerate(lookups.destination_directories()):
+            old = old_directories[index]
+            if old != os.path.join(new, ''):
+                # a folder shared with or nested in another category cannot tell which category a path came from
+                ambiguous = any(other.startswith(old) for other_index, other in enumerate(old_directories) if other_index != index)
+                moved.append((old, os.path.join(new, ''), ambiguous))
+
+        def migrate(name: str, value: tuple[str, str]) -> tuple[str, str]:
+            base, separator, extension = name.rpartition('.')
+            if not separator:
+                base = name
+            elif extension.lower() in changed_extensions:
+                return None
+            if changed_tokens and not changed_tokens.isdisjoint(SEPARATOR_PATTERN.split(base.lower())):
+                return None
+            file_name, dest_path = value
+            for old, new, ambiguous in moved:
+                if dest_path.startswith(old):
+                    return None if ambiguous else (file_name, new + dest_path[len(old):])
+            return value
+        return migrate
+
+    def match_tag(self, tokens: list[str], index: int) -> int:
+        if tokens[index] in self.tags:
+            return 1
+        node = self.tag_trie
+        length = 0
+        for token in tokens[index:]:
+            node = node.get(token)
+            if node is None:
+                break
+            length += 1
+            if None in node:
+                return length
+        return 0
+
+# ParseCache Class
+class ParseCache():
+    def __init__(self, max_size: int = 4096, location: str = None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.fingerprints = set()
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pending_writes = 0
+        self.hits = 0
+        self.misses = 0
+        if location:
+            import sqlite3
+            self.connection = sqlite3.connect(location, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS parse_cache (fingerprint TEXT, name TEXT, file_name TEXT, '
+                                    'dest_path TEXT, PRIMARY KEY (fingerprint, name)) WITHOUT ROWID')
+            self.connection.commit()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def register(self, fingerprint: str):
+        with self.lock:
+            self.fingerprints.add(fingerprint)
+
+    def get(self, fingerprint: str, name: str) -> tuple[str, str]:
+        key = (fingerprint, name)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if self.connection is not None:
+                row = self.connection.execute('SELECT file_name, dest_path FROM parse_cache WHERE fingerprint = ? AND name = ?',
+                                              key).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    self.store(key, row)
+                    return row
+            self.misses += 1
+            return None
+
+    def put(self, fingerprint: str, name: str, value: tuple[str, str]):
+        key = (fingerprint, name)
+        with self.lock:
+            self.store(key, value)
+            if self.connection is not None:
+                self.connection.execute('INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?)', key + tuple(value))
+                self.pending_writes += 1
+                if self.pending_writes >= 256:
+                    self.connection.commit()
+                    self.pending_writes = 0
+
+    def migrate(self, old_fingerprint: str, new_fingerprint: str, migrate) -> tuple[int, int]:
+        # moves the entries still valid under the new configuration to its fingerprint and drops the rest
+        kept = 0
+        dropped = 0
+        with self.lock:
+            self.fingerprints.add(new_fingerprint)
+            migrated = set()
+            for key, value in list(self.entries.items()):
+                if key[0] != old_fingerprint:
+                    continue
+                del self.entries[key]
+                value = migrate(key[1], value)
+                migrated.add(key[1])
+                if value is None:
+                    dropped += 1
+                else:
+                    self.entries[(new_fingerprint, key[1])] = value
+                    kept += 1
+            if self.connection is not None:
+                rows = []
+                for name, file_name, dest_path in self.connection.execute('SELECT name, file_name, dest_path FROM parse_cache '
+                                                                          'WHERE fingerprint = ?', (old_fingerprint,)).fetchall():
+                    value = migrate(name, (file_name, dest_path))
+                    if value is not None:
+                        rows.append((new_fingerprint, name) + tuple(value))
+                    if name not in migrated:
+                        kept, dropped = (kept + 1, dropped) if value is not None else (kept, dropped + 1)
+                self.connection.executemany('INSERT OR IGNORE INTO parse_cache VALUES (?, ?, ?, ?)', rows)
+                self.connection.commit()
+                self.pending_writes = 0
+        return kept, dropped
+
+    def store(self, key: tuple[str, str], value: tuple[str, str]):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def flush(self):
+        with self.lock:
+            if self.connection is not None and self.pending_writes:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            # drop rows written under configurations that are no longer in use
+            if self.fingerprints:
+                placeholders = ', '.join('?' * len(self.fingerprints))
+                self.connection.execute(f'DELETE FROM parse_cache WHERE fingerprint NOT IN ({placeholders})',
+                                        tuple(self.fingerprints))
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+# ParsedFilename Class
+class ParsedFilename():
+    def __init__(self):
+        self.tokens = []
+        self.first_tag_index = None
+        self.extension = ''
+        self.year = None
+        self.year_index = None
+        self.season = None
+        self.season_index = None
+        self.episode = None
+
+    @property
+    def formatted_name(self) -> str:
+        return ' '.join(self.tokens) + self.extension
 
 # FileFormatter Class
 class FileFormatter:
-    def __init__(self, config: FormatterConfig, logger: logging.Logger):
+    def __init__(self, config: FormatterConfig, logger: logging.Logger, cache: ParseCache = None):
         self.config = config
         self.logger = logger
+        if cache is None:
+            cache = ParseCache(config.parse_cache_size, config.parse_cache_location)
+        self.cache = cache
+        self.lookups = None
+        self.reload_config()
+
+    def reload_config(self, config: FormatterConfig = None):
+        if config is not None:
+            self.config = config
+        lookups = CompiledLookups(self.config)
+        if self.lookups is not None and self.lookups.fingerprint != lookups.fingerprint:
+            kept, dropped = self.cache.migrate(self.lookups.fingerprint, lookups.fingerprint, self.lookups.migration(lookups))
+            self.logger.info(f"Configuration changed, kept {kept} cached names and dropped {dropped}")
+        else:
+            self.cache.register(lookups.fingerprint)
+        # the lookups are immutable, so swapping the reference is all a reload needs
+        self.lookups = lookups
 
     def split_extension(self, filename: str) -> list[str]:
-        extension = filename.split('.')[-1]
-        if extension == filename:
+        name, separator, extension = filename.rpartition('.')
+        if not separator:
             return [filename, '']
-        extension = '.' + extension
-        return [filename[:-(len(extension))],  extension]
+        return [name, '.' + extension]
 
     def is_video(self, filename: str) -> bool:
         extension = self.split_extension(filename)[1]
         if extension == '':
             return False
-        return extension.removeprefix('.').lower() in self.config.extensions
+        return extension[1:].lower() in self.lookups.extensions
 
     def is_deletable(self, filename: str) -> bool:
         extension = self.split_extension(filename)[1]
-        return extension.removeprefix('.').lower() in self.config.extensions_to_delete
+        return extension[1:].lower() in self.lookups.extensions_to_delete
 
     def is_tag(self, word: str) -> bool:
-        return word.lower() in self.config.tags
+        return word.lower() in self.lookups.tags
     
     def find_year(self, file_name: str) -> str:
         split_filename = file_name.split(' ')
@@ -85,56 +576,109 @@ class FileFormatter:
         return None
 
     def change_symbols(self, word: str, char: chr ='') -> str:
-        return ''.join([self.convert_symbol(character, char) for character in word])
+        return SYMBOL_PATTERN.sub(char, word)
 
     def convert_symbol(self, originalchar: chr, replacementchar: chr ='') -> chr:
         if originalchar.isalnum():
             return originalchar
         return replacementchar
     
-    def format_filename(self, file_name: str) -> str:
-        name_and_extension = self.split_extension(file_name)
-        file_name_no_extension = name_and_extension[0].lower()
-        file_extension = name_and_extension[1]
-        
-        name_parts = [part for part in self.change_symbols(file_name_no_extension, ' ').split(' ') if part != '']
-        first_tag_index = 0
-        for part in name_parts:
-            if self.is_tag(part):
-                name_parts = name_parts[:first_tag_index]
+    def parse_filename(self, file_name: str) -> ParsedFilename:
+        start = time.perf_counter()
+        parsed = ParsedFilename()
+        name, parsed.extension = self.split_extension(file_name)
+        tokens = SEPARATOR_PATTERN.split(name.lower())
+        if tokens and tokens[0] == '':
+            tokens = tokens[1:]
+        if tokens and tokens[-1] == '':
+            tokens = tokens[:-1]
+
+        # single pass: stop at the first tag and pick up episode and year info on the way
+        lookups = self.lookups
+        tags = lookups.tags
+        tag_trie = lookups.tag_trie
+        season = None
+        season_index = None
+        episode = None
+        for index, token in enumerate(tokens):
+            if token in tags or (token in tag_trie and lookups.match_tag(tokens, index)):
+                parsed.first_tag_index = index
+                tokens = tokens[:index]
                 break
-            first_tag_index += 1
-        
-        formatted_name = ' '.join(name_parts)
-        
-        return formatted_name + file_extension
+            if parsed.season is not None:
+                continue
+            length = len(token)
+            if length == 3 and token[1:].isdigit():
+                if token[0] == 's':
+                    season = token
+                    season_index = index
+                elif token[0] == 'e':
+                    episode = token
+                if season and episode:
+                    parsed.season, parsed.season_index, parsed.episode = season, season_index, episode
+            elif length == 6 and token[0] == 's' and token[3] == 'e' and token[1:3].isdigit() and token[4:].isdigit():
+                parsed.season, parsed.season_index, parsed.episode = token[:3], index, token[3:]
+            elif length == 4 and index > 0 and parsed.year is None and token.isdigit():
+                parsed.year = token
+                parsed.year_index = index
+        parsed.tokens = tokens
+        PARSE_SECONDS.observe(time.perf_counter() - start)
+        return parsed
+
+    def format_filename(self, file_name: str) -> str:
+        return self.parse_filename(file_name).formatted_name
+
+    def resolve(self, file_name: str) -> tuple[str, str]:
+        lookups = self.lookups
+        fingerprint = lookups.fingerprint
+        cached = self.cache.get(fingerprint, file_name)
+        if cached is not None:
+            return cached
+        parsed = self.parse_filename(file_name)
+        formatted_name = parsed.formatted_name
+        resolved = (formatted_name, self.create_destination_path(formatted_name, parsed))
+        if self.lookups is lookups:
+            self.cache.put(fingerprint, file_name, resolved)
+        return resolved
     
-    def create_destination_path(self, file_name: str) -> str:
+    def create_destination_path(self, file_name: str, parsed: ParsedFilename = None) -> str:
+        start = time.perf_counter()
+        destination_path = self.build_destination_path(file_name, parsed)
+        DESTINATION_SECONDS.observe(time.perf_counter() - start)
+        return destination_path
+
+    def build_destination_path(self, file_name: str, parsed: ParsedFilename = None) -> str:
+        lookups = self.lookups
         if self.is_video(file_name):
-            name_and_extension = self.split_extension(file_name)
-            file_name_no_extension = name_and_extension[0]
-            file_extension = name_and_extension[1]
+            if parsed is None:
+                parsed = self.parse_filename(file_name)
             
             # dest/showname/Season xx/show name - sxx exx.ext
-            episode_info = self.find_episode_info(file_name_no_extension)
-            if episode_info:
-                show_name = file_name_no_extension[:file_name_no_extension.find(episode_info[0])-1].title()
-                return os.path.join(self.config.show_destination_directory,
+            if parsed.season is not None:
+                show_name = ' '.join(parsed.tokens[:parsed.season_index]).title()
+                return os.path.join(lookups.show_destination_directory,
                                     show_name,
-                                    f'Season {episode_info[0][1:]}',
-                                    show_name + f' - {episode_info[0]}{episode_info[1]}' + file_extension)
+                                    f'Season {parsed.season[1:]}',
+                                    show_name + f' - {parsed.season}{parsed.episode}' + parsed.extension)
             
             # dest/moviename (year)/moviename (year).ext
-            year = self.find_year(file_name_no_extension)
-            if year:
-                movie_name = file_name_no_extension[:file_name_no_extension.find(year)].title() + f'({year})'
-                return os.path.join(self.config.movie_destination_directory,
+            if parsed.year is not None:
+                movie_name = ' '.join(parsed.tokens[:parsed.year_index]).title() + f' ({parsed.year})'
+                return os.path.join(lookups.movie_destination_directory,
                                     movie_name,
-                                    movie_name + file_extension)
+                                    movie_name + parsed.extension)
             
-            return os.path.join(self.config.misc_destination_directory, file_name)
-        return os.path.join(self.config.non_video_destination_directory, file_name)
+            return os.path.join(lookups.misc_destination_directory, file_name)
+        return os.path.join(lookups.non_video_destination_directory, file_name)
   
+# MoveState Enum
+class MoveState(enum.Enum):
+    TRACKING = 'tracking'
+    QUEUED = 'queued'
+    MOVING = 'moving'
+    DONE = 'done'
+    FAILED = 'failed'
+
 # TrackedFile Class
 class TrackedFile():
     def __init__(self):
@@ -142,147 +686,2083 @@ class TrackedFile():
         self.file_name = ''
         self.src_path = ''
         self.dest_path = ''
+        self.state = MoveState.TRACKING
+        self.attempts = 0
+        self.next_check = 0
+        self.sample = None
+        self.stable_since = 0
+        self.check_interval = 0
+        self.closed = False
+        self.bytes_copied = 0
+        self.priority = 0
+
+# TrackedFileJournal Class
+class TrackedFileJournal():
+    def __init__(self, location: str = None, sync_interval: float = 5):
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pending = {}
+        self.last_sync = time.time()
+        if location:
+            import sqlite3
+            self.connection = sqlite3.connect(location, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tracked_files (src_path TEXT PRIMARY KEY, file_name TEXT, '
+                                    'dest_path TEXT, last_modification REAL, state TEXT, attempts INTEGER, '
+                                    'bytes_copied INTEGER) WITHOUT ROWID')
+            self.connection.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.connection is not None
+
+    def record(self, file: TrackedFile):
+        self.record_all([file])
+
+    def record_all(self, files: list[TrackedFile]):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.executemany('INSERT OR REPLACE INTO tracked_files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        [(file.src_path, file.file_name, file.dest_path, file.last_modification,
+                                          file.state.value, file.attempts, file.bytes_copied) for file in files])
+            self.connection.commit()
+
+    def update_state(self, file: TrackedFile, state: MoveState):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute('UPDATE tracked_files SET state = ?, attempts = ? WHERE src_path = ?',
+                                    (state.value, file.attempts, file.src_path))
+            self.connection.commit()
+
+    def progress(self, file: TrackedFile, bytes_copied: int):
+        # called for every copied chunk, rows are only written every sync_interval
+        file.bytes_copied = bytes_copied
+        with self.lock:
+            if self.connection is None:
+                return
+            self.pending[file.src_path] = file
+            if time.time() - self.last_sync >= self.sync_interval:
+                self.write_pending()
+
+    def sync(self, files, force: bool = False):
+        with self.lock:
+            if self.connection is None:
+                return
+            if not force and time.time() - self.last_sync < self.sync_interval:
+                return
+            for file in files:
+                self.pending.setdefault(file.src_path, file)
+            self.write_pending()
+
+    def write_pending(self):
+        # called with the lock held
+        self.connection.executemany('UPDATE tracked_files SET last_modification = ?, bytes_copied = ? WHERE src_path = ?',
+                                    [(file.last_modification, file.bytes_copied, file.src_path)
+                                     for file in self.pending.values()])
+        self.connection.commit()
+        self.pending.clear()
+        self.last_sync = time.time()
+
+    def remove(self, src_path: str):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.pending.pop(src_path, None)
+            self.connection.execute('DELETE FROM tracked_files WHERE src_path = ?', (src_path,))
+            self.connection.commit()
+
+    def load(self) -> list[TrackedFile]:
+        with self.lock:
+            if self.connection is None:
+                return []
+            rows = self.connection.execute('SELECT src_path, file_name, dest_path, last_modification, state, attempts, '
+                                           'bytes_copied FROM tracked_files').fetchall()
+        files = []
+        for src_path, file_name, dest_path, last_modification, state, attempts, bytes_copied in rows:
+            file = TrackedFile()
+            file.src_path = src_path
+            file.file_name = file_name
+            file.dest_path = dest_path
+            file.last_modification = last_modification
+            file.state = MoveState(state)
+            file.attempts = attempts
+            file.bytes_copied = bytes_copied
+            files.append(file)
+        return files
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            if self.pending:
+                self.write_pending()
+            self.connection.close()
+            self.connection = None
+
+# TrackedFileRegistry Class
+class TrackedFileRegistry():
+    def __init__(self):
+        self.files = {}
+        self.deadlines = []
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(list(self.files.values()))
+
+    def __contains__(self, src_path: str) -> bool:
+        return src_path in self.files
+
+    def get(self, src_path: str) -> TrackedFile:
+        return self.files.get(src_path)
+
+    def add(self, file: TrackedFile):
+        with self.lock:
+            self.files[file.src_path] = file
+            self.push(file)
+
+    def push(self, file: TrackedFile):
+        # heap entries are never updated in place, a stale entry is re-pushed when it surfaces
+        self.sequence += 1
+        heapq.heappush(self.deadlines, (file.next_check, self.sequence, file.src_path))
+
+    def touch(self, src_path: str, timestamp: float = None) -> bool:
+        file = self.files.get(src_path)
+        if file is None:
+            return False
+        file.last_modification = timestamp if timestamp is not None else time.time()
+        return True
+
+    def remove(self, src_path: str) -> TrackedFile:
+        with self.lock:
+            file = self.files.pop(src_path, None)
+            if len(self.deadlines) > 2 * len(self.files) + 64:
+                self.deadlines = [(tracked.next_check, index, tracked.src_path) for index, tracked in enumerate(self.files.values())]
+                heapq.heapify(self.deadlines)
+                self.sequence = len(self.deadlines)
+            return file
+
+    def reschedule(self, file: TrackedFile):
+        with self.lock:
+            if self.files.get(file.src_path) is file:
+                self.push(file)
+
+    def pop_due(self, current_time: float) -> list[TrackedFile]:
+        # due files stay registered, the caller either removes or reschedules them
+        due = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= current_time:
+                _, _, src_path = heapq.heappop(self.deadlines)
+                file = self.files.get(src_path)
+                if file is None or file in due:
+                    continue
+                if file.next_check > current_time:
+                    self.push(file)
+                    continue
+                due.append(file)
+        return due
+
+# CompletionDetector Class
+class CompletionDetector():
+    def __init__(self, config: FormatterConfig):
+        self.delay = config.delay_before_moving
+        self.check_open_handles = config.check_open_handles
+
+    def first_check(self, file: TrackedFile) -> float:
+        return file.last_modification + self.delay
+
+    def check(self, file: TrackedFile, current_time: float) -> float:
+        # returns None once the file is complete, otherwise the time of the next check
+        if current_time - file.last_modification <= self.delay:
+            return file.last_modification + self.delay
+        return self.check_handles(file, current_time)
+
+    def resume(self, file: TrackedFile) -> float:
+        return self.first_check(file)
+
+    def check_handles(self, file: TrackedFile, current_time: float) -> float:
+        if self.check_open_handles and is_open_for_writing(file.src_path):
+            return current_time + max(self.delay, 1)
+        return None
+
+# StabilityDetector Class
+class StabilityDetector(CompletionDetector):
+    def __init__(self, config: FormatterConfig):
+        super().__init__(config)
+        self.delay = config.stability_quiet_time
+        self.min_interval = config.stability_min_interval
+        self.max_interval = config.stability_max_interval
+
+    def sample(self, file: TrackedFile):
+        try:
+            stat = os.stat(file.src_path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def first_check(self, file: TrackedFile) -> float:
+        file.sample = self.sample(file)
+        file.stable_since = time.time()
+        file.check_interval = self.min_interval
+        return file.stable_since + self.delay
+
+    def resume(self, file: TrackedFile) -> float:
+        # count the quiet time from before the restart instead of waiting all over again
+        file.sample = self.sample(file)
+        file.stable_since = file.last_modification
+        if file.sample is not None:
+            file.stable_since = max(file.stable_since, file.sample[1] / 1e9)
+        file.check_interval = self.min_interval
+        return file.stable_since + self.delay
+
+    def check(self, file: TrackedFile, current_time: float) -> float:
+        sample = self.sample(file)
+        if sample is None:
+            return None
+        if sample != file.sample:
+            # the file is still growing, back off while it keeps changing
+            file.sample = sample
+            file.stable_since = current_time
+            file.check_interval = min(file.check_interval * 2, self.max_interval) or self.min_interval
+            return current_time + max(file.check_interval, self.delay)
+        # a stalled download looks stable too, only a close after write or a handle check cuts the quiet time short
+        quiet_time = min(self.delay, self.min_interval) if file.closed or self.check_open_handles else self.delay
+        quiet_since = max(file.stable_since, file.last_modification)
+        if current_time - quiet_since < quiet_time:
+            return quiet_since + quiet_time
+        file.check_interval = self.min_interval
+        return self.check_handles(file, current_time)
+
+COMPLETION_DETECTORS = {'delay': CompletionDetector, 'stability': StabilityDetector}
+
+def create_completion_detector(config: FormatterConfig) -> CompletionDetector:
+    detector = COMPLETION_DETECTORS.get(config.completion_detector)
+    if detector is None:
+        raise ValueError(f'unknown completion detector {config.completion_detector}, expected one of {tuple(COMPLETION_DETECTORS)}')
+    return detector(config)
+
+def is_open_for_writing(path: str) -> bool:
+    try:
+        target = os.stat(path)
+        pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return False
+    for pid in pids:
+        try:
+            descriptors = os.listdir(f'/proc/{pid}/fd')
+        except OSError:
+            continue
+        for descriptor in descriptors:
+            try:
+                stat = os.stat(f'/proc/{pid}/fd/{descriptor}')
+                if stat.st_ino != target.st_ino or stat.st_dev != target.st_dev:
+                    continue
+                with open(f'/proc/{pid}/fdinfo/{descriptor}') as fdinfo:
+                    flags = next(int(line.split()[1], 8) for line in fdinfo if line.startswith('flags:'))
+            except (OSError, StopIteration, ValueError):
+                continue
+            if flags & (os.O_WRONLY | os.O_RDWR):
+                return True
+    return False
+
+# TransferResult Class
+class TransferResult():
+    def __init__(self, method: str, size: int, seconds: float):
+        self.method = method
+        self.bytes = size
+        self.seconds = seconds
+
+    @property
+    def bytes_per_second(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / self.seconds
+
+# IOScheduler Class
+class IOScheduler():
+    def __init__(self, config: FormatterConfig, window: float = 10):
+        self.window = window
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.history = deque()
+        self.transferred = 0
+        self.throttled_seconds = 0.0
+        self.configure(config)
+
+    def configure(self, config: FormatterConfig):
+        # profiles are {'start': 'HH:MM', 'end': 'HH:MM', 'rate': bytes per second}, 0 means no limit
+        profiles = []
+        for profile in config.transfer_rate_profiles:
+            start, end = (self.parse_time(profile[key]) for key in ('start', 'end'))
+            profiles.append((start, end, profile['rate']))
+        self.profiles = profiles
+        self.default_limit = config.transfer_rate_limit
+
+    def parse_time(self, value: str) -> int:
+        hours, separator, minutes = value.partition(':')
+        if not separator or not hours.isdigit() or not minutes.isdigit() or int(hours) > 23 or int(minutes) > 59:
+            raise ValueError(f'invalid time of day {value}, expected HH:MM')
+        return int(hours) * 60 + int(minutes)
+
+    def limit(self, current_time: float = None) -> float:
+        local_time = time.localtime(current_time)
+        minutes = local_time.tm_hour * 60 + local_time.tm_min
+        for start, end, rate in self.profiles:
+            if start <= minutes < end or (end < start and (minutes >= start or minutes < end)):
+                return rate
+        return self.default_limit
+
+    def chunk_size(self, chunk_size: int) -> int:
+        # small chunks under a cap, so the sleeps stay short and the disk sees an even stream
+        limit = self.limit()
+        if not limit:
+            return chunk_size
+        return max(min(chunk_size, int(limit / 4)), 65536)
+
+    def consume(self, size: int):
+        # called after each chunk, a transfer that ran ahead of the bucket sleeps off its debt
+        limit = self.limit()
+        delay = 0
+        with self.lock:
+            current_time = time.monotonic()
+            self.transferred += size
+            self.history.append((current_time, size))
+            while self.history[0][0] < current_time - self.window:
+                self.history.popleft()
+            if limit:
+                self.tokens = min(self.tokens + (current_time - self.last_refill) * limit, limit) - size
+                if self.tokens < 0:
+                    delay = -self.tokens / limit
+                    self.throttled_seconds += delay
+            else:
+                self.tokens = 0
+            self.last_refill = current_time
+        if delay > 0:
+            time.sleep(delay)
+
+    def throughput(self) -> float:
+        with self.lock:
+            current_time = time.monotonic()
+            while self.history and self.history[0][0] < current_time - self.window:
+                self.history.popleft()
+            return sum(size for _, size in self.history) / self.window
+
+# TransferEngine Class
+class TransferEngine():
+    def __init__(self, config: FormatterConfig, logger: logging.Logger, scheduler: IOScheduler = None):
+        self.logger = logger
+        self.mode = config.transfer_mode
+        self.chunk_size = config.transfer_chunk_size
+        self.scheduler = scheduler if scheduler is not None else IOScheduler(config)
+
+    def transfer(self, src_path: str, dest_path: str, progress=None, resume_offset: int = 0) -> TransferResult:
+        start = time.perf_counter()
+        size = os.stat(src_path).st_size
+        if self.mode == 'hardlink':
+            method = self.link(src_path, dest_path, progress, resume_offset)
+        elif self.mode == 'reflink':
+            method = self.reflink(src_path, dest_path, progress, resume_offset)
+        else:
+            method = self.move(src_path, dest_path, progress, resume_offset)
+        return TransferResult(method, size, time.perf_counter() - start)
+
+    def move(self, src_path: str, dest_path: str, progress=None, resume_offset: int = 0) -> str:
+        try:
+            os.rename(src_path, dest_path)
+            return 'rename'
+        except OSError as error:
+            if error.errno != errno.EXDEV:
+                raise
+        method = self.copy(src_path, dest_path, progress, resume_offset)
+        os.remove(src_path)
+        return method
+
+    def link(self, src_path: str, dest_path: str, progress=None, resume_offset: int = 0) -> str:
+        # link modes leave the source in place so torrents keep seeding
+        if os.path.exists(dest_path) and os.path.samefile(src_path, dest_path):
+            return 'hardlink'
+        # link under a temporary name and swap it in so an existing file gets replaced like a move would
+        link_path = dest_path + '.link'
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        try:
+            os.link(src_path, link_path)
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            return self.copy(src_path, dest_path, progress, resume_offset)
+        os.replace(link_path, dest_path)
+        return 'hardlink'
+
+    def reflink(self, src_path: str, dest_path: str, progress=None, resume_offset: int = 0) -> str:
+        import fcntl
+        partial_path = dest_path + '.part'
+        try:
+            with open(src_path, 'rb') as src, open(partial_path, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), 0x40049409, src.fileno()) # FICLONE
+            shutil.copystat(src_path, partial_path)
+            os.replace(partial_path, dest_path)
+            return 'reflink'
+        except OSError:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return self.copy(src_path, dest_path, progress, 0)
+
+    def copy(self, src_path: str, dest_path: str, progress=None, resume_offset: int = 0) -> str:
+        # copy next to the destination and rename, so the library never sees a partial file
+        partial_path = dest_path + '.part'
+        offset = 0
+        if resume_offset > 0 and os.path.exists(partial_path):
+            offset = min(resume_offset, os.path.getsize(partial_path), os.path.getsize(src_path))
+        try:
+            with open(src_path, 'rb') as src, open(partial_path, 'r+b' if offset else 'wb') as dest:
+                if offset:
+                    self.logger.info(f"Resuming copy of {src_path} at {offset} bytes")
+                    dest.truncate(offset)
+                    dest.seek(offset)
+                    src.seek(offset)
+                method = self.copy_data(src, dest, progress)
+            shutil.copystat(src_path, partial_path)
+            os.replace(partial_path, dest_path)
+        except Exception:
+            # keep the partial file when resuming is possible, a retry or restart can continue from it
+            if progress is None and os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return method
+
+    def copy_data(self, src, dest, progress=None) -> str:
+        src_fd = src.fileno()
+        dest_fd = dest.fileno()
+        offset = dest.tell()
+        chunk_size = self.scheduler.chunk_size(self.chunk_size)
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while (copied := os.copy_file_range(src_fd, dest_fd, chunk_size)) > 0:
+                    offset += copied
+                    self.scheduler.consume(copied)
+                    if progress is not None:
+                        progress(offset)
+                return 'copy_file_range'
+            except OSError as error:
+                if error.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        offset = dest.tell()
+        if hasattr(os, 'sendfile'):
+            try:
+                while (sent := os.sendfile(dest_fd, src_fd, offset, chunk_size)) > 0:
+                    offset += sent
+                    self.scheduler.consume(sent)
+                    if progress is not None:
+                        progress(offset)
+                return 'sendfile'
+            except OSError as error:
+                if error.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        src.seek(offset)
+        dest.seek(offset)
+        while data := src.read(chunk_size):
+            dest.write(data)
+            offset += len(data)
+            self.scheduler.consume(len(data))
+            if progress is not None:
+                progress(offset)
+        return 'copyfileobj'
+
+# DirectoryCache Class
+class DirectoryCache():
+    def __init__(self):
+        self.known = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, directory: str) -> bool:
+        return os.path.normpath(directory) in self.known
+
+    def seed(self, directories: list[str]):
+        for directory in directories:
+            if os.path.isdir(directory):
+                with self.lock:
+                    self.known.add(os.path.normpath(directory))
+
+    def ensure(self, directory: str):
+        directory = os.path.normpath(directory)
+        if directory in self.known:
+            self.hits += 1
+            return
+        with self.lock:
+            # only the levels below the closest known ancestor are created, every other file in the folder hits the cache
+            missing = []
+            parent = directory
+            while parent not in self.known and parent != os.path.dirname(parent):
+                missing.append(parent)
+                parent = os.path.dirname(parent)
+            if not missing:
+                self.hits += 1
+                return
+            self.misses += 1
+            for path in reversed(missing):
+                try:
+                    os.mkdir(path)
+                except FileExistsError:
+                    pass
+                self.known.add(path)
+
+    def invalidate(self, directory: str):
+        directory = os.path.normpath(directory)
+        with self.lock:
+            self.known = {path for path in self.known if path != directory and not path.startswith(directory + os.sep)}
+
+def sample_fingerprint(path: str, block_size: int = 1024 * 1024) -> tuple[int, str]:
+    # hashes the first, middle and last block, so a 50 GB file costs three reads
+    with open(path, 'rb') as file:
+        return sample_stream_fingerprint(file, os.fstat(file.fileno()).st_size, block_size)
+
+def sample_stream_fingerprint(stream, size: int, block_size: int = 1024 * 1024) -> tuple[int, str]:
+    # same sampling as sample_fingerprint for any stream, streams that cannot seek are read through to each block
+    digest = hashlib.blake2b(digest_size=16)
+    if size <= block_size * 3:
+        digest.update(stream.read())
+        return size, digest.hexdigest()
+    position = 0
+    for offset in (0, (size - block_size) // 2, size - block_size):
+        if stream.seekable():
+            stream.seek(offset)
+        else:
+            while position < offset and (skipped := stream.read(min(block_size, offset - position))):
+                position += len(skipped)
+        data = stream.read(block_size)
+        position = offset + len(data)
+        digest.update(data)
+    return size, digest.hexdigest()
+
+# LibraryIndex Class
+class LibraryIndex():
+    def __init__(self, location: str = None, block_size: int = 1024 * 1024):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        import sqlite3
+        self.connection = sqlite3.connect(location or ':memory:', check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS library (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                                'fingerprint TEXT)')
+        self.connection.commit()
+        self.hashed = 0
+
+    def get(self, path: str) -> tuple[int, str]:
+        # returns the indexed fingerprint, hashing the file again only when its size or mtime changed
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.remove(path)
+            return None
+        with self.lock:
+            if self.connection is None:
+                return sample_fingerprint(path, self.block_size)
+            row = self.connection.execute('SELECT size, mtime_ns, fingerprint FROM library WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[0], row[2]
+        fingerprint = sample_fingerprint(path, self.block_size)
+        self.hashed += 1
+        self.add(path, fingerprint)
+        return fingerprint
+
+    def add(self, path: str, fingerprint: tuple[int, str]):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute('INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?)', (path, fingerprint[0], mtime_ns, fingerprint[1]))
+            self.connection.commit()
+
+    def remove(self, path: str):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute('DELETE FROM library WHERE path = ?', (path,))
+            self.connection.commit()
+
+    def scan(self, directory: str) -> int:
+        count = 0
+        for path in iter_files(directory):
+            if not path.endswith('.part'):
+                self.get(path)
+                count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+# DuplicateResolver Class
+class DuplicateResolver():
+    policies = ('skip', 'replace', 'version')
+    # versioned names handed out but not moved yet, shared by every resolver so parallel moves never pick the same one
+    reserved = set()
+    reservation_lock = threading.Lock()
+
+    def __init__(self, config: FormatterConfig, logger: logging.Logger, index: LibraryIndex = None):
+        if config.duplicate_policy not in self.policies:
+            raise ValueError(f'unknown duplicate policy {config.duplicate_policy}, expected one of {self.policies}')
+        self.policy = config.duplicate_policy
+        self.logger = logger
+        if index is None:
+            index = LibraryIndex(config.library_index_location, config.fingerprint_block_size)
+        self.index = index
+        self.duplicates = 0
+
+    def resolve(self, src_path: str, dest_path: str) -> tuple[str, str, tuple[int, str]]:
+        # returns the action ('move', 'duplicate' or 'skip'), the destination to use and the source fingerprint,
+        # nothing is hashed unless the destination already exists
+        if not os.path.exists(dest_path) or os.path.abspath(src_path) == os.path.abspath(dest_path):
+            return 'move', dest_path, None
+        return self.resolve_existing(src_path, dest_path, os.path.getsize(src_path),
+                                     lambda: sample_fingerprint(src_path, self.index.block_size))
+
+    def resolve_existing(self, src_path: str, dest_path: str, size: int, fingerprint_function) -> tuple[str, str, tuple[int, str]]:
+        # the source is only hashed when its size matches the existing file, the fingerprint is None otherwise
+        existing = self.index.get(dest_path)
+        fingerprint = fingerprint_function() if size == existing[0] else None
+        if fingerprint == existing:
+            self.duplicates += 1
+            self.logger.info(f"{src_path} is already in the library as {dest_path}")
+            return 'duplicate', dest_path, fingerprint
+        if self.policy == 'skip':
+            self.logger.info(f"Skipping {src_path}, a different {dest_path} already exists")
+            return 'skip', dest_path, fingerprint
+        if self.policy == 'version':
+            dest_path = self.versioned_path(dest_path)
+            self.logger.info(f"{src_path} differs from the existing file, keeping both as {dest_path}")
+        else:
+            self.logger.info(f"Replacing {dest_path} with {src_path}")
+        return 'move', dest_path, fingerprint
+
+    @classmethod
+    def versioned_path(cls, dest_path: str) -> str:
+        # reserves the name until release, a copy still in flight under a temporary name also counts as taken
+        base, extension = os.path.splitext(dest_path)
+        version = 2
+        with cls.reservation_lock:
+            while True:
+                path = f'{base} ({version}){extension}'
+                if path not in cls.reserved and not any(os.path.lexists(path + suffix) for suffix in ('', '.part', '.link')):
+                    cls.reserved.add(path)
+                    return path
+                version += 1
+
+    @classmethod
+    def release(cls, dest_path: str):
+        with cls.reservation_lock:
+            cls.reserved.discard(dest_path)
+
+    def moved(self, dest_path: str, fingerprint: tuple[int, str]):
+        if fingerprint is not None:
+            self.index.add(dest_path, fingerprint)
+
+    def close(self):
+        self.index.close()
+
+# MoveWorkerPool Class
+class MoveWorkerPool():
+    def __init__(self, config: FormatterConfig, logger: logging.Logger, handler, workers: int = None,
+                 thread_name_prefix: str = 'plexformatter-move'):
+        self.logger = logger
+        self.handler = handler
+        self.on_finished = None
+        self.moves_per_device = config.moves_per_device
+        self.max_retries = config.move_retries
+        self.retry_delay = config.move_retry_delay
+        self.small_file_size = config.small_file_size
+        self.sequence = itertools.count()
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=workers or config.move_workers, thread_name_prefix=thread_name_prefix)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.queues = {}
+        self.active = {}
+        self.files = {}
+        self.devices = {}
+        self.timers = {}
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def device_of(self, path: str) -> int:
+        directory = os.path.dirname(path)
+        device = self.devices.get(directory)
+        if device is not None:
+            return device
+        parent = directory
+        while parent and not os.path.exists(parent):
+            if parent == os.path.dirname(parent):
+                break
+            parent = os.path.dirname(parent)
+        try:
+            device = os.stat(parent).st_dev
+        except OSError:
+            device = -1
+        self.devices[directory] = device
+        return device
+
+    def submit(self, file: TrackedFile):
+        device = self.device_of(file.dest_path)
+        try:
+            size = os.path.getsize(file.src_path)
+        except OSError:
+            size = 0
+        # subtitles and episodes go ahead of large remuxes, files of the same class keep their order
+        file.priority = 0 if size < self.small_file_size else 1
+        with self.lock:
+            file.state = MoveState.QUEUED
+            self.files[file.src_path] = file
+            self.enqueue(file, device)
+            self.dispatch(device)
+
+    def enqueue(self, file: TrackedFile, device: int):
+        # called with the lock held
+        heapq.heappush(self.queues.setdefault(device, []), (file.priority, next(self.sequence), file))
+
+    def dispatch(self, device: int):
+        # called with the lock held, keeps at most moves_per_device transfers running per device
+        device_queue = self.queues.get(device)
+        while device_queue and not self.closed and self.active.get(device, 0) < self.moves_per_device:
+            file = heapq.heappop(device_queue)[2]
+            self.active[device] = self.active.get(device, 0) + 1
+            self.executor.submit(self.run, file, device)
+
+    def run(self, file: TrackedFile, device: int):
+        file.state = MoveState.MOVING
+        file.attempts += 1
+        error = None
+        try:
+            self.handler(file)
+        except Exception as exception:
+            error = exception
+        finished = True
+        with self.lock:
+            self.active[device] -= 1
+            if error is None:
+                file.state = MoveState.DONE
+            elif file.attempts <= self.max_retries and not self.closed:
+                delay = self.retry_delay * 2 ** (file.attempts - 1)
+                self.logger.warning(f'Moving {file.src_path} failed ({error}), retrying in {delay}s')
+                file.state = MoveState.QUEUED
+                timer = threading.Timer(delay, self.requeue, [file, device])
+                timer.daemon = True
+                self.timers[file.src_path] = timer
+                timer.start()
+                finished = False
+            else:
+                file.state = MoveState.FAILED
+                self.logger.error(f'Moving {file.src_path} failed after {file.attempts} attempts: {error}')
+            if finished:
+                self.files.pop(file.src_path, None)
+            self.dispatch(device)
+            self.idle.notify_all()
+        if finished and self.on_finished is not None:
+            self.on_finished(file)
+
+    def requeue(self, file: TrackedFile, device: int):
+        with self.lock:
+            # a timer cancelled by retry_now may already be waiting on the lock
+            if self.timers.get(file.src_path) is not threading.current_thread():
+                return
+            del self.timers[file.src_path]
+            if self.closed:
+                return
+            self.enqueue(file, device)
+            self.dispatch(device)
+
+    def retry_now(self, src_path: str) -> bool:
+        # skips the backoff of a file waiting to be retried and gives it a fresh set of attempts
+        with self.lock:
+            timer = self.timers.pop(src_path, None)
+            if timer is None or self.closed:
+                return False
+            timer.cancel()
+            file = self.files[src_path]
+            file.attempts = 0
+            device = self.device_of(file.dest_path)
+            self.enqueue(file, device)
+            self.dispatch(device)
+            return True
+
+    def join(self, timeout: float = None) -> bool:
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.files, timeout)
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def archive_volume(path: str) -> tuple[str, bool]:
+    # returns the key shared by every volume of an archive set and whether this is the first volume
+    match = ARCHIVE_PATTERN.match(os.path.basename(path))
+    if match is None:
+        return None
+    extension = match['extension'].lower()
+    if match['part'] is not None and extension != 'rar':
+        return None
+    key = os.path.join(os.path.dirname(path), match['base'].lower())
+    if match['part'] is not None:
+        return key, int(match['part']) == 1
+    return key, extension in ('rar', 'zip')
+
+# ArchiveExtractor Class
+class ArchiveExtractor():
+    def __init__(self, config: FormatterConfig, logger: logging.Logger, file_formatter: FileFormatter,
+                 transfer_engine: TransferEngine, directory_cache: DirectoryCache, duplicate_resolver: DuplicateResolver):
+        self.config = config
+        self.logger = logger
+        self.file_formatter = file_formatter
+        self.transfer_engine = transfer_engine
+        self.directory_cache = directory_cache
+        self.duplicate_resolver = duplicate_resolver
+        self.extracted = 0
+
+    def volumes(self, path: str) -> list[str]:
+        key = archive_volume(path)[0]
+        directory = os.path.dirname(path)
+        with os.scandir(directory) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file() and (archive_volume(entry.path) or ('',))[0] == key)
+
+    def open(self, path: str):
+        if path.lower().endswith('.zip'):
+            import zipfile
+            return zipfile.ZipFile(path)
+        try:
+            import rarfile
+        except ImportError:
+            self.logger.warning(f"Cannot extract {path}, the rarfile package is not installed")
+            return None
+        return rarfile.RarFile(path)
+
+    def video_members(self, archive) -> list:
+        members = []
+        for member in archive.infolist():
+            name = member.filename.replace('\\', '/')
+            if member.is_dir() or not self.file_formatter.is_video(name):
+                continue
+            if 'sample' in SEPARATOR_PATTERN.split(name.lower()):
+                continue
+            members.append(member)
+        return members
+
+    def destination(self, path: str, member_name: str) -> str:
+        # obfuscated names inside the archive fall back to the release name of the archive itself
+        parsed = self.file_formatter.parse_filename(member_name)
+        if parsed.season is None and parsed.year is None:
+            release_name = ARCHIVE_PATTERN.match(os.path.basename(path))['base'] + parsed.extension
+            release = self.file_formatter.parse_filename(release_name)
+            if release.season is not None or release.year is not None:
+                parsed = release
+        return self.file_formatter.create_destination_path(parsed.formatted_name, parsed)
+
+    def extract(self, path: str) -> list[str]:
+        # streams every video straight into the library, returns None when the archive has to be moved as it is
+        try:
+            return self.extract_videos(path)
+        except self.archive_errors() as error:
+            # corrupt, encrypted or unsupported archives would fail every retry, move them like any other file
+            self.logger.warning(f"Cannot extract {path} ({type(error).__name__}: {error}), moving the archive as it is")
+            return None
+
+    def archive_errors(self) -> tuple:
+        import zipfile
+        errors = [zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError, EOFError]
+        try:
+            import rarfile
+            errors.append(rarfile.Error)
+        except ImportError:
+            pass
+        return tuple(errors)
+
+    def extract_videos(self, path: str) -> list[str]:
+        archive = self.open(path)
+        if archive is None:
+            return None
+        extracted = []
+        with archive:
+            members = self.video_members(archive)
+            if not members:
+                return None
+            for member in members:
+                dest_path = self.destination(path, os.path.basename(member.filename.replace('\\', '/')))
+                fingerprint = None
+                if os.path.exists(dest_path):
+                    # link modes keep the volumes around, so the same set is seen again after every restart
+                    action, dest_path, fingerprint = self.duplicate_resolver.resolve_existing(
+                        f'{member.filename} from {path}', dest_path, member.file_size,
+                        lambda: self.member_fingerprint(archive, member))
+                    if action != 'move':
+                        continue
+                start = time.perf_counter()
+                try:
+                    self.directory_cache.ensure(os.path.dirname(dest_path))
+                    self.stream(archive, member, dest_path)
+                finally:
+                    self.duplicate_resolver.release(dest_path)
+                seconds = time.perf_counter() - start
+                self.duplicate_resolver.moved(dest_path, fingerprint)
+                self.extracted += 1
+                extracted.append(dest_path)
+                self.logger.info(f"Extracted {member.filename} from {path} to {dest_path} "
+                                 f"({member.file_size} bytes, {member.file_size / 1048576 / max(seconds, 1e-9):.1f} MiB/s)")
+        return extracted
+
+    def member_fingerprint(self, archive, member) -> tuple[int, str]:
+        with archive.open(member) as stream:
+            return sample_stream_fingerprint(stream, member.file_size, self.duplicate_resolver.index.block_size)
+
+    def stream(self, archive, member, dest_path: str):
+        partial_path = dest_path + '.part'
+        scheduler = self.transfer_engine.scheduler
+        chunk_size = scheduler.chunk_size(self.transfer_engine.chunk_size)
+        try:
+            with archive.open(member) as src, open(partial_path, 'wb') as dest:
+                while data := src.read(chunk_size):
+                    dest.write(data)
+                    scheduler.consume(len(data))
+            os.replace(partial_path, dest_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+# WatchFolderSweeper Class
+class WatchFolderSweeper():
+    def __init__(self, root: str, rescan_interval: float = 300):
+        self.root = os.path.normpath(root)
+        self.rescan_interval = rescan_interval
+        # watch roots nested in this one, they belong to another daemon and are never swept
+        self.excluded = set()
+        self.listings = {}
+        self.empty = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.last_rescan = time.time()
+        self.last_result = None
+        self.scans = 0
+
+    def mark_dirty(self, path: str):
+        path = os.path.normpath(path)
+        with self.lock:
+            self.dirty.add(path)
+            self.dirty.add(os.path.dirname(path))
+
+    def invalidate(self):
+        with self.lock:
+            self.listings.clear()
+            self.empty.clear()
+            self.dirty.clear()
+            self.last_result = None
+        self.last_rescan = time.time()
+
+    def apply_dirty(self) -> bool:
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+        for path in dirty:
+            self.listings.pop(path, None)
+            # a change anywhere below a top level folder can change whether that folder is empty
+            while True:
+                self.empty.pop(path, None)
+                if path == self.root or not path.startswith(self.root + os.sep):
+                    break
+                path = os.path.dirname(path)
+        return bool(dirty)
+
+    def listing(self, directory: str) -> tuple:
+        listing = self.listings.get(directory)
+        if listing is None:
+            subdirectories = []
+            has_files = False
+            self.scans += 1
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.path in self.excluded:
+                            has_files = True
+                        elif entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        else:
+                            has_files = True
+            except OSError:
+                has_files = True
+            listing = (subdirectories, has_files)
+            self.listings[directory] = listing
+        return listing
+
+    def is_empty_tree(self, directory: str) -> bool:
+        empty = self.empty.get(directory)
+        if empty is None:
+            subdirectories, has_files = self.listing(directory)
+            empty = not has_files and all(self.is_empty_tree(subdirectory) for subdirectory in subdirectories)
+            self.empty[directory] = empty
+        return empty
+
+    def sweep(self) -> list[str]:
+        if time.time() - self.last_rescan > self.rescan_interval:
+            self.invalidate()
+        if not self.apply_dirty() and self.last_result is not None:
+            return self.last_result
+        self.last_result = [directory for directory in self.listing(self.root)[0] if self.is_empty_tree(directory)]
+        return self.last_result
+
+# FileSystemEvent Class
+class FileSystemEvent():
+    def __init__(self, event_type: str, src_path: str, is_directory: bool = False, dest_path: str = ''):
+        self.event_type = event_type
+        self.src_path = src_path
+        self.is_directory = is_directory
+        self.dest_path = dest_path
+
+    def __repr__(self) -> str:
+        return f'FileSystemEvent({self.event_type!r}, {self.src_path!r}, is_directory={self.is_directory})'
+
+# EventHandler Class
+class EventHandler():
+    # the observer only calls dispatch, so handlers work with watchdog's events and our own without importing it
+    def dispatch(self, event):
+        handler = getattr(self, 'on_' + event.event_type, None)
+        if handler is not None:
+            handler(event)
+
+def create_observer():
+    from watchdog.observers import Observer
+    return Observer()
+
+# EventCoalescer Class
+class EventCoalescer(EventHandler):
+    event_types = frozenset({'created', 'modified', 'deleted', 'closed'})
+
+    def __init__(self, window: float = 0.5, batches: queue.Queue = None):
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.batches = batches if batches is not None else queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.raw_events = 0
+        self.coalesced_events = 0
+        self.batch_count = 0
+
+    def dispatch(self, event):
+        with self.lock:
+            self.raw_events += 1
+            if event.event_type == 'moved':
+                self.record(event.src_path, 'deleted', event.is_directory)
+                self.record(event.dest_path, 'created', event.is_directory)
+            elif event.event_type in self.event_types:
+                self.record(event.src_path, event.event_type, event.is_directory)
+
+    def record(self, path: str, event_type: str, is_directory: bool):
+        # called with the lock held, folds the new event into whatever is pending for the path
+        key = (path, is_directory)
+        pending = self.pending.get(key)
+        if pending is None:
+            if event_type == 'closed':
+                self.pending[key] = [None, time.monotonic(), True]
+            else:
+                self.pending[key] = [event_type, time.monotonic(), False]
+            return
+        previous_type = pending[0]
+        if event_type == 'closed':
+            pending[2] = True
+        elif previous_type is None:
+            pending[0] = event_type
+        elif event_type == 'modified':
+            if previous_type == 'deleted':
+                pending[0] = 'modified'
+        elif event_type == 'deleted':
+            if previous_type == 'created':
+                del self.pending[key]
+            else:
+                pending[0] = 'deleted'
+        else:
+            pending[0] = 'created'
+
+    def flush(self, force: bool = False) -> int:
+        cutoff = time.monotonic() - self.window
+        batch = []
+        with self.lock:
+            for key, (event_type, first_seen, closed) in list(self.pending.items()):
+                if force or first_seen <= cutoff:
+                    path, is_directory = key
+                    if event_type is not None:
+                        batch.append(FileSystemEvent(event_type, path, is_directory))
+                    if closed and event_type != 'deleted':
+                        batch.append(FileSystemEvent('closed', path))
+                    del self.pending[key]
+            self.coalesced_events += len(batch)
+            if batch:
+                self.batch_count += 1
+        if batch:
+            self.batches.put(batch)
+        return len(batch)
+
+    def run(self):
+        while not self.stopped.wait(self.window / 2):
+            self.flush()
+        self.flush(force=True)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='plexformatter-events', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self) -> dict:
+        return {'raw_events': self.raw_events, 'coalesced_events': self.coalesced_events, 'batches': self.batch_count}
 
 # Daemon Class
-class Daemon(FileSystemEventHandler):
-    def __init__(self, config: FormatterConfig, file_formatter: FileFormatter, logger: logging.Logger):
+class Daemon(EventHandler):
+    # settings that can change while running, everything else needs a restart
+    hot_settings = frozenset({
+        'extensions', 'extensions_to_delete', 'tags', 'show_destination_directory', 'movie_destination_directory',
+        'misc_destination_directory', 'non_video_destination_directory', 'completion_detector', 'delay_before_moving',
+        'stability_quiet_time', 'stability_min_interval', 'stability_max_interval', 'check_open_handles',
+        'use_close_events', 'duplicate_policy', 'log_level', 'metrics_dump_interval', 'config_check_interval',
+        'transfer_rate_limit', 'transfer_rate_profiles'
+    })
+
+    def __init__(self, config: FormatterConfig, file_formatter: FileFormatter, logger: logging.Logger,
+                 observer=None, batches: queue.Queue = None, library_index: LibraryIndex = None,
+                 io_scheduler: IOScheduler = None):
         self.config = config
         self.file_formatter = file_formatter
         self.logger = logger
-        self.observer = Observer()
-        self.tracked_files = []
-        self.delay_before_moving = 60
+        self.observer = observer if observer is not None else create_observer()
+        self.tracked_files = TrackedFileRegistry()
+        self.journal = TrackedFileJournal(config.journal_location, config.journal_sync_interval)
+        self.completion_detector = create_completion_detector(config)
+        self.transfer_engine = TransferEngine(config, logger, io_scheduler)
+        self.directory_cache = DirectoryCache()
+        self.duplicate_resolver = DuplicateResolver(config, logger, library_index)
+        self.move_pool = MoveWorkerPool(config, logger, self.process_file)
+        self.move_pool.on_finished = self.on_file_finished
+        self.archive_extractor = ArchiveExtractor(config, logger, file_formatter, self.transfer_engine, self.directory_cache,
+                                                  self.duplicate_resolver)
+        self.extraction_pool = MoveWorkerPool(config, logger, self.extract_archive, config.extraction_workers,
+                                              'plexformatter-extract')
+        self.extraction_pool.on_finished = self.on_file_finished
+        self.failed_archives = {}
+        self.sweeper = WatchFolderSweeper(config.watch_directory, config.sweep_rescan_interval)
+        self.coalescer = EventCoalescer(config.event_window, batches)
+        self.metrics_server = None
+        self.config_watcher = None
+        self.last_metrics_dump = 0
+        self.stopping = threading.Event()
+        self.missing_paths = []
+        self.last_path_check = 0
+        self.path_check_interval = 10
+        self.metric_sources = [
+            ('gauge', 'plexformatter_tracked_files', 'Files waiting for their download to complete.', lambda: len(self.tracked_files)),
+            ('gauge', 'plexformatter_move_queue', 'Files queued or being moved.', lambda: len(self.move_pool)),
+            ('gauge', 'plexformatter_extraction_queue', 'Archives queued or being extracted.', lambda: len(self.extraction_pool)),
+            ('counter', 'plexformatter_extracted_files_total', 'Videos streamed out of archives.',
+             lambda: self.archive_extractor.extracted),
+            ('counter', 'plexformatter_events_total', 'Raw events received from the observer.', lambda: self.coalescer.raw_events),
+            ('counter', 'plexformatter_coalesced_events_total', 'Events handed to the daemon after coalescing.',
+             lambda: self.coalescer.coalesced_events),
+            ('counter', 'plexformatter_duplicates_total', 'Files skipped because the library already had them.',
+             lambda: self.duplicate_resolver.duplicates),
+            ('counter', 'plexformatter_directory_cache_hits_total', 'Destination folders found in the directory cache.',
+             lambda: self.directory_cache.hits),
+            ('counter', 'plexformatter_directory_cache_misses_total', 'Destination folders that had to be created.',
+             lambda: self.directory_cache.misses),
+        ]
+        # the parse cache and io scheduler can be shared between daemons, only the daemon with shared_metrics set
+        # registers their metrics and serves them so a DaemonGroup does not count them once per root
+        self.shared_metrics = True
+        self.shared_metric_sources = [
+            ('counter', 'plexformatter_parse_cache_hits_total', 'Parse cache hits.', lambda: self.file_formatter.cache.hits),
+            ('counter', 'plexformatter_parse_cache_misses_total', 'Parse cache misses.', lambda: self.file_formatter.cache.misses),
+            ('gauge', 'plexformatter_transfer_rate_limit_bytes', 'Current transfer bandwidth cap, 0 when unlimited.',
+             lambda: self.transfer_engine.scheduler.limit()),
+            ('gauge', 'plexformatter_transfer_rate_bytes', 'Bytes per second copied over the last 10 seconds.',
+             lambda: self.transfer_engine.scheduler.throughput()),
+            ('counter', 'plexformatter_throttled_seconds_total', 'Time transfers slept to stay under the bandwidth cap.',
+             lambda: self.transfer_engine.scheduler.throttled_seconds),
+        ]
+
+    @property
+    def delay_before_moving(self) -> float:
+        return self.completion_detector.delay
+
+    @delay_before_moving.setter
+    def delay_before_moving(self, delay: float):
+        self.completion_detector.delay = delay
 
     def on_modified(self, event):
         if not event.is_directory:
             self.logger.debug(f"Modification detected: {event.src_path}")
-            for file in self.tracked_files:
-                if file.src_path == event.src_path:
-                    file.last_modification = time.time()
-                    break
+            self.tracked_files.touch(event.src_path)
+        else:
+            self.sweeper.mark_dirty(event.src_path)
 
     def on_created(self, event):
+        self.sweeper.mark_dirty(event.src_path)
         if not event.is_directory:
             self.logger.info(f"New file detected: {event.src_path}")
             self.add_file(event.src_path)
+
+    def on_closed(self, event):
+        if self.config.use_close_events and not event.is_directory:
+            file = self.tracked_files.get(event.src_path)
+            if file is not None:
+                self.logger.debug(f"Close after write detected: {event.src_path}")
+                file.closed = True
+                file.next_check = time.time()
+                self.tracked_files.reschedule(file)
+
+    def on_deleted(self, event):
+        self.sweeper.mark_dirty(event.src_path)
+        if not event.is_directory and self.tracked_files.remove(event.src_path):
+            self.journal.remove(event.src_path)
+            self.logger.info(f"Tracked file removed: {event.src_path}")
+
+    def on_moved(self, event):
+        self.sweeper.mark_dirty(event.src_path)
+        self.sweeper.mark_dirty(event.dest_path)
+        if not event.is_directory:
+            if self.tracked_files.remove(event.src_path):
+                self.journal.remove(event.src_path)
+            if self.owns(event.dest_path):
+                self.logger.info(f"Renamed file detected: {event.dest_path}")
+                self.add_file(event.dest_path)
+
+    def owns(self, path: str) -> bool:
+        return path.startswith(self.sweeper.root + os.sep) and not any(path.startswith(root + os.sep) for root in self.sweeper.excluded)
+
+    def process_events(self, timeout: float = 1):
+        try:
+            batch = self.coalescer.batches.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            for event in batch:
+                self.dispatch(event)
+            try:
+                batch = self.coalescer.batches.get_nowait()
+            except queue.Empty:
+                return
+
+    def on_file_finished(self, file: TrackedFile):
+        if file.state == MoveState.FAILED:
+            METRICS.inc('plexformatter_move_failures_total')
+            archive = archive_volume(file.src_path) if self.config.extract_archives else None
+            if archive is not None and archive[1]:
+                # the set may not have been complete yet, try again when another volume finishes
+                self.failed_archives[archive[0]] = file
+        self.journal.remove(file.src_path)
+        self.sweeper.mark_dirty(file.src_path)
     
     def add_file(self, file_path: str):
+        if file_path in self.tracked_files:
+            self.tracked_files.touch(file_path)
+            return
+        if file_path in self.move_pool.files or file_path in self.extraction_pool.files:
+            return
         file = TrackedFile()
         file.src_path = file_path
-        file.file_name = self.file_formatter.format_filename(os.path.basename(file_path))
-        file.dest_path = self.file_formatter.create_destination_path(file.file_name)
-        self.tracked_files.append(file)
-        
-    def find_files(self, file_path: str):
-        if os.path.exists(file_path):
-            if os.path.isfile(file_path):
-                self.logger.info(f"File found at {file_path}")
-                self.add_file(file_path)
-            elif os.path.isdir(file_path):
-                for file in os.listdir(file_path):
-                    self.find_files(os.path.join(file_path, file))
+        file.file_name, file.dest_path = self.file_formatter.resolve(os.path.basename(file_path))
+        file.next_check = self.completion_detector.first_check(file)
+        self.tracked_files.add(file)
+        self.journal.record(file)
+
+    def restore(self):
+        # picks up where the last run stopped, without parsing or waiting for the quiet period again
+        restored = 0
+        for file in self.journal.load():
+            if not self.owns(file.src_path):
+                continue
+            if not os.path.exists(file.src_path):
+                self.journal.remove(file.src_path)
+                continue
+            if file.state in (MoveState.QUEUED, MoveState.MOVING):
+                self.logger.info(f"Resuming move of {file.src_path} ({file.bytes_copied} bytes copied)")
+                self.submit_file(file)
+            else:
+                file.state = MoveState.TRACKING
+                file.next_check = self.completion_detector.resume(file)
+                self.tracked_files.add(file)
+            restored += 1
+        if restored:
+            self.logger.info(f"Restored {restored} files from the journal")
+
+    def submit_file(self, file: TrackedFile) -> TrackedFile:
+        # returns the first volume of the set when a later volume puts it back into tracked_files
+        archive = archive_volume(file.src_path) if self.config.extract_archives else None
+        if archive is not None and not archive[1]:
+            # later volumes are read through the first one, they stay until the set is extracted
+            self.journal.remove(file.src_path)
+            return self.requeue_archive(archive[0])
+        self.journal.update_state(file, MoveState.QUEUED)
+        if archive is not None:
+            self.extraction_pool.submit(file)
         else:
+            self.move_pool.submit(file)
+        return None
+
+    def requeue_archive(self, key: str) -> TrackedFile:
+        # a first volume that finished before the rest of its set gave up or is backing off, retry it now
+        for path in list(self.extraction_pool.files):
+            if archive_volume(path) == (key, True):
+                self.extraction_pool.retry_now(path)
+                return None
+        file = self.failed_archives.pop(key, None)
+        if file is None or not os.path.exists(file.src_path):
+            return None
+        self.logger.info(f"Another volume of {file.src_path} finished, extracting it again")
+        file.state = MoveState.TRACKING
+        file.attempts = 0
+        file.next_check = time.time()
+        self.tracked_files.add(file)
+        self.journal.record(file)
+        return file
+
+    def archive_pending(self, file: TrackedFile) -> bool:
+        # an archive set is complete once none of its volumes is still being downloaded
+        archive = archive_volume(file.src_path) if self.config.extract_archives else None
+        if archive is None or not archive[1]:
+            return False
+        return any(other is not file and (archive_volume(other.src_path) or ('',))[0] == archive[0]
+                   for other in self.tracked_files)
+
+    def find_files(self, file_path: str):
+        if os.path.isfile(file_path):
+            self.logger.info(f"File found at {file_path}")
+            self.add_file(file_path)
+            return
+        if not os.path.isdir(file_path):
             self.logger.warning(f"{self.find_files.__name__}: {file_path} is not a valid path.")
+            return
+        directories = [file_path]
+        while directories:
+            directory = directories.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            if os.path.normpath(entry.path) not in self.sweeper.excluded:
+                                directories.append(entry.path)
+                        elif entry.is_file():
+                            self.logger.info(f"File found at {entry.path}")
+                            self.add_file(entry.path)
+            except OSError as error:
+                self.logger.warning(f"{self.find_files.__name__}: cannot scan {directory}: {error}")
 
     def is_empty_directory_tree(self, directory: str):
-        if os.path.exists(directory) and os.path.isdir(directory):
-            subfolders = []
-            for file in os.listdir(directory):
-                file = os.path.join(directory, file)
-                if os.path.isdir(file):
-                    subfolders.append(file)
-                else:
-                    return False
-            result = True
-            for folder in subfolders:
-                result = result and self.is_empty_directory_tree(folder)
-                if result == False: return result
-            return result
-        else:
+        if os.path.normpath(directory) in self.sweeper.excluded:
             return False
+        try:
+            with os.scandir(directory) as entries:
+                subfolders = []
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        return False
+                    subfolders.append(entry.path)
+        except OSError:
+            return False
+        return all(self.is_empty_directory_tree(folder) for folder in subfolders)
 
     def find_empty_directories(self, directory):
-        return [os.path.join(directory, dir) for dir in os.listdir(directory) if self.is_empty_directory_tree(os.path.join(directory, dir))]
+        with os.scandir(directory) as entries:
+            subfolders = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        return [folder for folder in subfolders if self.is_empty_directory_tree(folder)]
 
     def clean_watch_folder(self):
-        for dir in self.find_empty_directories(self.config.watch_directory):
-            shutil.rmtree(dir)
+        start = time.perf_counter()
+        for dir in self.sweeper.sweep():
+            # the sweeper works from cached listings, confirm on disk before deleting anything
+            if self.is_empty_directory_tree(dir):
+                shutil.rmtree(dir)
+            self.sweeper.mark_dirty(dir)
+        METRICS.observe('plexformatter_sweep_seconds', time.perf_counter() - start)
+
+    def owned_metric_sources(self) -> list:
+        return self.metric_sources + self.shared_metric_sources if self.shared_metrics else self.metric_sources
+
+    def start_metrics(self):
+        for metric_type, name, description, function in self.owned_metric_sources():
+            METRICS.register(metric_type, name, description, function)
+        if self.shared_metrics and self.config.metrics_port is not None:
+            self.metrics_server = MetricsServer(METRICS, self.config.metrics_address, self.config.metrics_port)
+            self.metrics_server.start()
+            self.logger.info(f"Serving metrics on {self.config.metrics_address}:{self.metrics_server.port}")
+
+    def dump_metrics(self, force: bool = False):
+        if self.config.metrics_file is None:
+            return
+        current_time = time.time()
+        if force or current_time - self.last_metrics_dump >= self.config.metrics_dump_interval:
+            self.last_metrics_dump = current_time
+            try:
+                METRICS.dump(self.config.metrics_file)
+            except OSError as error:
+                self.logger.warning(f"Cannot write metrics to {self.config.metrics_file}: {error}")
+
+    def stop_metrics(self):
+        self.dump_metrics(force=True)
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        for metric_type, name, description, function in self.owned_metric_sources():
+            METRICS.unregister(name, function)
 
     def check_tracked_files(self):
         current_time = time.time()
-        to_remove = []
-        for file in self.tracked_files:
-            if current_time - file.last_modification > self.delay_before_moving:
-                if self.file_formatter.is_deletable(file.src_path):
-                    os.remove(file.src_path)
-                    self.logger.info(f'deleted {file.src_path}')
-                else:
-                    self.move_file(file)
-                to_remove.append(file)
-        for file in to_remove:
-            self.tracked_files.remove(file)
-        
+        finished = []
+        for file in self.tracked_files.pop_due(current_time):
+            next_check = self.completion_detector.check(file, current_time)
+            if next_check is None and not self.destination_ready(file.dest_path):
+                next_check = current_time + self.path_check_interval
+            if next_check is None and self.archive_pending(file):
+                next_check = current_time + max(self.completion_detector.delay, 1)
+            if next_check is None:
+                self.tracked_files.remove(file.src_path)
+                finished.append(file)
+            else:
+                file.next_check = next_check
+                self.tracked_files.reschedule(file)
+        # submit files for the same folder together so the first move creates it and the rest hit the directory cache
+        finished.sort(key=lambda file: os.path.dirname(file.dest_path))
+        for file in finished:
+            self.submit_file(file)
+        self.journal.sync(self.tracked_files)
+
+    def process_file(self, file: TrackedFile):
+        self.journal.update_state(file, MoveState.MOVING)
+        if self.file_formatter.is_deletable(file.src_path):
+            os.remove(file.src_path)
+            self.logger.info(f'deleted {file.src_path}')
+        else:
+            self.move_file(file)
+
+    def extract_archive(self, file: TrackedFile):
+        self.journal.update_state(file, MoveState.MOVING)
+        volumes = self.archive_extractor.volumes(file.src_path)
+        extracted = self.archive_extractor.extract(file.src_path)
+        for volume in volumes:
+            self.sweeper.mark_dirty(volume)
+            if extracted is None:
+                # nothing to extract, the set goes to the library as before
+                archive_file = TrackedFile()
+                archive_file.src_path = volume
+                archive_file.file_name, archive_file.dest_path = self.file_formatter.resolve(os.path.basename(volume))
+                self.move_file(archive_file)
+            elif self.transfer_engine.mode == 'move':
+                os.remove(volume)
+
     def move_file(self, file: TrackedFile):
-        if not os.path.exists(os.path.dirname(file.dest_path)):
-            os.makedirs(os.path.dirname(file.dest_path))
-        shutil.move(file.src_path, file.dest_path)
-        self.logger.info(f"Moved {file.src_path} to {file.dest_path}")
+        action, dest_path, fingerprint = self.duplicate_resolver.resolve(file.src_path, file.dest_path)
+        if action == 'duplicate':
+            if self.transfer_engine.mode == 'move':
+                # the library already holds this file, finish the move by dropping the download
+                os.remove(file.src_path)
+            return
+        if action == 'skip':
+            return
+        if dest_path != file.dest_path:
+            file.dest_path = dest_path
+            # journal the versioned name before copying, so a resumed move finds its .part instead of picking the next name
+            self.journal.record(file)
+        directory = os.path.dirname(file.dest_path)
+        try:
+            self.directory_cache.ensure(directory)
+            if self.journal.enabled:
+                result = self.transfer_engine.transfer(file.src_path, file.dest_path,
+                                                       lambda copied: self.journal.progress(file, copied), file.bytes_copied)
+            else:
+                result = self.transfer_engine.transfer(file.src_path, file.dest_path)
+        except OSError:
+            # the folder may have been removed or the mount may have gone away, check it again on the retry
+            self.directory_cache.invalidate(directory)
+            raise
+        finally:
+            self.duplicate_resolver.release(file.dest_path)
+        self.duplicate_resolver.moved(file.dest_path, fingerprint)
+        METRICS.observe('plexformatter_move_seconds', result.seconds)
+        METRICS.inc('plexformatter_moved_bytes_total', result.bytes)
+        METRICS.inc('plexformatter_moves_total')
+        limit = self.transfer_engine.scheduler.limit()
+        cap = f" of {limit / 1048576:.1f} MiB/s cap" if limit else ''
+        self.logger.info(f"Moved {file.src_path} to {file.dest_path} "
+                         f"({result.method}, {result.bytes} bytes, {result.bytes_per_second / 1048576:.1f} MiB/s{cap})")
         
+    def reload_config(self, config: FormatterConfig):
+        changed = {name for name, value in vars(config).items() if getattr(self.config, name, None) != value}
+        restart = sorted(changed - self.hot_settings)
+        if restart:
+            self.logger.warning(f"{', '.join(restart)} changed, restart the daemon to apply")
+        changed &= self.hot_settings
+        if not changed:
+            return
+        if config.duplicate_policy not in DuplicateResolver.policies:
+            self.logger.error(f"Unknown duplicate policy {config.duplicate_policy}, keeping the current configuration")
+            return
+        if config.completion_detector not in COMPLETION_DETECTORS:
+            self.logger.error(f"Unknown completion detector {config.completion_detector}, keeping the current configuration")
+            return
+        reloaded = copy.copy(self.config)
+        for name in changed:
+            setattr(reloaded, name, getattr(config, name))
+        try:
+            self.transfer_engine.scheduler.configure(reloaded)
+        except (ValueError, KeyError, TypeError) as error:
+            self.logger.error(f"Invalid transfer_rate_profiles ({error}), keeping the current configuration")
+            self.transfer_engine.scheduler.configure(self.config)
+            return
+        fingerprint = self.file_formatter.lookups.fingerprint
+        self.file_formatter.reload_config(reloaded)
+        if self.file_formatter.lookups.fingerprint != fingerprint:
+            # files still waiting for their download to finish go where the new settings put them
+            files = list(self.tracked_files)
+            for file in files:
+                file.file_name, file.dest_path = self.file_formatter.resolve(os.path.basename(file.src_path))
+            self.journal.record_all(files)
+        self.completion_detector = create_completion_detector(reloaded)
+        self.duplicate_resolver.policy = reloaded.duplicate_policy
+        if 'log_level' in changed:
+            self.logger.setLevel(reloaded.log_level)
+        self.config = reloaded
+        self.logger.info(f"Reloaded configuration: {', '.join(sorted(changed))}")
+
+    def check_config(self):
+        if self.config_watcher is not None:
+            config = self.config_watcher.poll()
+            if config is not None:
+                self.reload_config(config)
+
+    def watch_config(self):
+        if self.config.config_file is not None:
+            self.config_watcher = ConfigWatcher(self.config.config_file, self.logger, self.config.config_check_interval)
+
     def signal_handler(self, signum, frame):
         signame = signal.Signals(signum).name
         self.logger.info(f'Signal handler called with signal {signame} ({signum})')
-        self.stop()
+        # the interrupted code may hold the journal, cache or metrics locks, leave the shutdown to the main loop
+        self.stopping.set()
+
+    def wait_for_paths(self, timeout: float = 100):
+        # only the watch folder is needed to start, moves into destinations that are not mounted yet wait in check_paths
+        deadline = time.time() + timeout
+        while not os.path.isdir(self.config.watch_directory):
+            if time.time() >= deadline:
+                self.logger.error(f'cannot find watch folder {self.config.watch_directory}')
+                exit(1)
+            self.logger.warning(f'waiting for watch folder {self.config.watch_directory}')
+            time.sleep(1)
+        self.check_paths(force=True)
+
+    def check_paths(self, force: bool = False):
+        current_time = time.time()
+        if not force and current_time - self.last_path_check < self.path_check_interval:
+            return
+        self.last_path_check = current_time
+        missing_paths = [os.path.join(path, '') for path in self.config.destination_directories() if not os.path.isdir(path)]
+        if missing_paths == self.missing_paths:
+            return
+        if missing_paths:
+            self.logger.warning(f'cannot find paths, holding moves into them: {missing_paths}')
+        else:
+            self.logger.info('all destination folders are available')
+        self.missing_paths = missing_paths
+        self.directory_cache.seed(self.config.destination_directories())
+
+    def destination_ready(self, dest_path: str) -> bool:
+        return not any(dest_path.startswith(path) for path in self.missing_paths)
+
+    def startup(self):
+        self.start_metrics()
+        self.coalescer.start()
+        self.observer.schedule(self.coalescer, self.config.watch_directory, recursive=True)
+
+    def shutdown(self):
+        self.coalescer.stop()
+        self.move_pool.shutdown()
+        self.extraction_pool.shutdown()
+        self.stop_metrics()
+        self.journal.close()
+        self.duplicate_resolver.close()
+        self.file_formatter.cache.close()
 
     def start(self):
-        failed_count = 0
-        missing_paths = [path for path in [self.config.watch_directory, self.config.misc_destination_directory,
-                                     self.config.movie_destination_directory, self.config.show_destination_directory,
-                                     self.config.non_video_destination_directory, self.config.log_location]
-                                    if not os.path.exists(path)]
-        while len(missing_paths) > 0:
-            self.logger.warn(f'cannot find paths: {missing_paths}')
-            time.sleep(10)
-            failed_count = failed_count + 1
-            if failed_count > 10: exit(1)
-        event_handler = self
-        self.observer.schedule(event_handler, self.config.watch_directory, recursive=True)
+        self.wait_for_paths()
+        self.startup()
+        self.watch_config()
         self.observer.start()
         self.logger.info("Daemon started. Watching directory for changes...")
         signal.signal(signal.SIGTERM, self.signal_handler)
+        self.restore()
         self.find_files(self.config.watch_directory)
         try:
-            while self.observer.is_alive():
-                time.sleep(1)
+            while self.observer.is_alive() and not self.stopping.is_set():
+                self.process_events(timeout=1)
+                self.check_paths()
                 self.check_tracked_files()
                 self.clean_watch_folder()
+                self.dump_metrics()
+                self.check_config()
         except KeyboardInterrupt:
-            self.observer.stop()
             self.logger.info("Daemon stopped by user.")
+        self.stop()
+
+    def stop(self):
+        self.observer.stop()
         self.observer.join()
-        
+        self.shutdown()
+        self.logger.info("Daemon stopped.")
+
+# DaemonGroup Class
+class DaemonGroup():
+    def __init__(self, config: FormatterConfig, logger: logging.Logger):
+        # one daemon per watch root, each with its own tracked files and move pool so a slow disk only
+        # holds up its own moves, while the observer, event queue and parse cache are shared
+        self.config = config
+        self.logger = logger
+        self.observer = create_observer()
+        self.batches = queue.Queue()
+        self.config_watcher = None
+        self.stopping = threading.Event()
+        self.cache = ParseCache(config.parse_cache_size, config.parse_cache_location)
+        self.library_index = LibraryIndex(config.library_index_location, config.fingerprint_block_size)
+        # the bandwidth cap protects the library disk, so all roots draw from one bucket
+        self.io_scheduler = IOScheduler(config)
+        self.daemons = [Daemon(root_config, FileFormatter(root_config, logger, self.cache), logger, self.observer, self.batches,
+                               self.library_index, self.io_scheduler)
+                        for root_config in config.root_configs()]
+        # nested roots resolve to the deepest one
+        self.daemons.sort(key=lambda daemon: len(daemon.sweeper.root), reverse=True)
+        roots = [daemon.sweeper.root for daemon in self.daemons]
+        for daemon in self.daemons:
+            daemon.sweeper.excluded = {root for root in roots if root.startswith(daemon.sweeper.root + os.sep)}
+        for daemon in self.daemons[1:]:
+            daemon.shared_metrics = False
+
+    def daemon_for(self, path: str) -> Daemon:
+        for daemon in self.daemons:
+            if daemon.owns(path) or path == daemon.sweeper.root:
+                return daemon
+        return None
+
+    def process_events(self, timeout: float = 1):
+        try:
+            batch = self.batches.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            for event in batch:
+                daemon = self.daemon_for(event.src_path)
+                if daemon is not None:
+                    daemon.dispatch(event)
+            try:
+                batch = self.batches.get_nowait()
+            except queue.Empty:
+                return
+
+    def reload_config(self, config: FormatterConfig):
+        root_configs = {os.path.normpath(root_config.watch_directory): root_config for root_config in config.root_configs()}
+        if root_configs.keys() != {daemon.sweeper.root for daemon in self.daemons}:
+            self.logger.warning("watch_roots changed, restart the daemon to watch the new folders")
+        for daemon in self.daemons:
+            root_config = root_configs.get(daemon.sweeper.root)
+            if root_config is not None:
+                daemon.reload_config(root_config)
+
+    def check_config(self):
+        config = self.config_watcher.poll() if self.config_watcher is not None else None
+        if config is not None:
+            self.reload_config(config)
+
+    def signal_handler(self, signum, frame):
+        signame = signal.Signals(signum).name
+        self.logger.info(f'Signal handler called with signal {signame} ({signum})')
+        # same as Daemon.signal_handler, the main loop does the shutdown
+        self.stopping.set()
+
+    def start(self):
+        if self.config.config_file is not None:
+            self.config_watcher = ConfigWatcher(self.config.config_file, self.logger, self.config.config_check_interval)
+        for daemon in self.daemons:
+            daemon.wait_for_paths()
+            daemon.startup()
+        self.observer.start()
+        self.logger.info(f"Daemon started. Watching {len(self.daemons)} directories for changes...")
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        for daemon in self.daemons:
+            daemon.restore()
+            daemon.find_files(daemon.config.watch_directory)
+        try:
+            while self.observer.is_alive() and not self.stopping.is_set():
+                self.process_events(timeout=1)
+                for daemon in self.daemons:
+                    daemon.check_paths()
+                    daemon.check_tracked_files()
+                    daemon.clean_watch_folder()
+                self.daemons[0].dump_metrics()
+                self.check_config()
+        except KeyboardInterrupt:
+            self.logger.info("Daemon stopped by user.")
+        self.stop()
+
     def stop(self):
         self.observer.stop()
         self.observer.join()
+        for daemon in self.daemons:
+            daemon.shutdown()
         self.logger.info("Daemon stopped.")
 
+# AsyncRuntime Class
+class AsyncRuntime():
+    def __init__(self, daemon: Daemon):
+        self.daemon = daemon
+        self.logger = daemon.logger
+        self.loop = None
+        self.events = None
+        self.stopping = None
+        self.timers = {}
+        self.sweep_handle = None
+        self.metrics_handle = None
+        self.config_handle = None
+
+    def dispatch(self, event):
+        # runs on the observer thread, modifications only move a timestamp and never wake the loop
+        if event.event_type == 'modified' and not event.is_directory:
+            self.daemon.tracked_files.touch(event.src_path)
+        elif event.event_type in ('created', 'deleted', 'moved', 'modified', 'closed'):
+            self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    def schedule(self, src_path: str, delay: float):
+        handle = self.timers.get(src_path)
+        if handle is not None:
+            handle.cancel()
+        self.timers[src_path] = self.loop.call_later(max(delay, 0), self.on_quiet_period, src_path)
+
+    def schedule_tracked_files(self):
+        for file in self.daemon.tracked_files:
+            self.schedule_file(file.src_path)
+
+    def schedule_file(self, src_path: str):
+        file = self.daemon.tracked_files.get(src_path)
+        if file is not None and src_path not in self.timers:
+            self.schedule(src_path, file.next_check - time.time())
+
+    def on_quiet_period(self, src_path: str):
+        self.timers.pop(src_path, None)
+        file = self.daemon.tracked_files.get(src_path)
+        if file is None:
+            return
+        self.loop.run_in_executor(None, self.check_file, file).add_done_callback(self.on_checked)
+
+    def check_file(self, file: TrackedFile) -> list[TrackedFile]:
+        # runs in the executor so stat calls, path checks and the journal never block the loop,
+        # returns the files that need another check
+        daemon = self.daemon
+        current_time = time.time()
+        next_check = daemon.completion_detector.check(file, current_time)
+        if next_check is None:
+            daemon.check_paths()
+            if not daemon.destination_ready(file.dest_path):
+                next_check = current_time + daemon.path_check_interval
+            elif daemon.archive_pending(file):
+                next_check = current_time + max(daemon.completion_detector.delay, 1)
+        if next_check is not None:
+            file.next_check = next_check
+            return [file]
+        if not daemon.tracked_files.remove(file.src_path):
+            # deleted, or already submitted by a check that overlapped this one
+            return []
+        lead = daemon.submit_file(file)
+        daemon.journal.sync(daemon.tracked_files)
+        # a later volume can put the first one of its set back into tracked_files
+        return [lead] if lead is not None else []
+
+    def on_checked(self, future):
+        for file in future.result():
+            self.schedule_file(file.src_path)
+
+    def on_file_finished(self, file: TrackedFile):
+        self.daemon.on_file_finished(file)
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.schedule_sweep)
+
+    def schedule_sweep(self):
+        if self.sweep_handle is None:
+            self.sweep_handle = self.loop.call_later(1, self.run_sweep)
+
+    def run_sweep(self):
+        self.sweep_handle = None
+        self.loop.run_in_executor(None, self.daemon.clean_watch_folder)
+
+    def run_config_check(self):
+        self.loop.run_in_executor(None, self.daemon.check_config)
+        self.config_handle = self.loop.call_later(self.daemon.config_watcher.interval, self.run_config_check)
+
+    def run_metrics_dump(self):
+        self.loop.run_in_executor(None, self.daemon.dump_metrics, True)
+        self.metrics_handle = self.loop.call_later(self.daemon.config.metrics_dump_interval, self.run_metrics_dump)
+
+    async def consume_events(self):
+        while True:
+            event = await self.events.get()
+            # handlers parse the name, resolve duplicates and write the journal, keep that off the loop
+            await self.loop.run_in_executor(None, self.daemon.dispatch, event)
+            if event.event_type in ('created', 'moved') and not event.is_directory:
+                self.schedule_file(event.dest_path if event.event_type == 'moved' else event.src_path)
+            elif event.event_type == 'closed':
+                if event.src_path in self.daemon.tracked_files:
+                    self.schedule(event.src_path, 0)
+                continue
+            elif event.event_type == 'deleted' and event.src_path in self.timers:
+                self.timers.pop(event.src_path).cancel()
+            if event.is_directory or event.event_type != 'created':
+                self.schedule_sweep()
+
+    def stop(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def run(self):
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.stopping = asyncio.Event()
+        daemon = self.daemon
+        await self.loop.run_in_executor(None, daemon.wait_for_paths)
+        daemon.start_metrics()
+        daemon.move_pool.on_finished = self.on_file_finished
+        daemon.extraction_pool.on_finished = self.on_file_finished
+        daemon.observer.schedule(self, daemon.config.watch_directory, recursive=True)
+        daemon.observer.start()
+        self.logger.info("Daemon started with asyncio runtime. Watching directory for changes...")
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(signum, self.stopping.set)
+            except (RuntimeError, ValueError):
+                pass
+        consumer = asyncio.create_task(self.consume_events())
+        await self.loop.run_in_executor(None, daemon.restore)
+        await self.loop.run_in_executor(None, daemon.find_files, daemon.config.watch_directory)
+        self.schedule_tracked_files()
+        self.schedule_sweep()
+        if daemon.config.metrics_file is not None:
+            self.run_metrics_dump()
+        daemon.watch_config()
+        if daemon.config_watcher is not None:
+            self.config_handle = self.loop.call_later(daemon.config_watcher.interval, self.run_config_check)
+        await self.stopping.wait()
+        consumer.cancel()
+        for handle in self.timers.values():
+            handle.cancel()
+        for handle in (self.sweep_handle, self.metrics_handle, self.config_handle):
+            if handle is not None:
+                handle.cancel()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.loop.remove_signal_handler(signum)
+        daemon.observer.stop()
+        await self.loop.run_in_executor(None, daemon.observer.join)
+        daemon.move_pool.shutdown()
+        daemon.extraction_pool.shutdown()
+        daemon.stop_metrics()
+        daemon.journal.close()
+        daemon.duplicate_resolver.close()
+        daemon.file_formatter.cache.close()
+        self.logger.info("Daemon stopped.")
+
+# Batch Import
+import_formatter = None
+
+def iter_files(root: str):
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def init_import_worker(config: FormatterConfig):
+    global import_formatter
+    import_formatter = FileFormatter(config, logging.getLogger('FileFormatterImport'), ParseCache(0))
+
+def plan_import_chunk(paths: list[str]) -> list[tuple[str, str, str]]:
+    plan = []
+    for path in paths:
+        if import_formatter.is_deletable(path):
+            plan.append((path, '', 'delete'))
+            continue
+        parsed = import_formatter.parse_filename(os.path.basename(path))
+        dest_path = import_formatter.create_destination_path(parsed.formatted_name, parsed)
+        plan.append((path, dest_path, 'skip' if os.path.abspath(path) == os.path.abspath(dest_path) else 'move'))
+    return plan
+
+# BatchImporter Class
+class BatchImporter():
+    def __init__(self, config: FormatterConfig, logger: logging.Logger, workers: int = None, chunk_size: int = 1024):
+        self.config = config
+        self.logger = logger
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.transfer_engine = TransferEngine(config, logger)
+        self.directory_cache = DirectoryCache()
+        self.duplicate_resolver = DuplicateResolver(config, logger)
+
+    def plan(self, root: str) -> list[tuple[str, str, str]]:
+        chunks = chunked(iter_files(root), self.chunk_size)
+        if self.workers <= 1:
+            init_import_worker(self.config)
+            return [step for chunk in map(plan_import_chunk, chunks) for step in chunk]
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(self.workers, initializer=init_import_worker, initargs=(self.config,)) as executor:
+            return [step for chunk in executor.map(plan_import_chunk, chunks) for step in chunk]
+
+    def execute(self, step: tuple[str, str, str]) -> int:
+        src_path, dest_path, action = step
+        try:
+            if action == 'delete':
+                os.remove(src_path)
+                self.logger.info(f'deleted {src_path}')
+            elif action == 'move':
+                action, dest_path, fingerprint = self.duplicate_resolver.resolve(src_path, dest_path)
+                if action == 'duplicate' and self.transfer_engine.mode == 'move':
+                    os.remove(src_path)
+                if action != 'move':
+                    return 0
+                try:
+                    result = self.transfer_engine.transfer(src_path, dest_path)
+                finally:
+                    self.duplicate_resolver.release(dest_path)
+                self.duplicate_resolver.moved(dest_path, fingerprint)
+                self.logger.info(f"Moved {src_path} to {dest_path} ({result.method}, {result.bytes} bytes)")
+                return result.bytes
+        except OSError as error:
+            self.logger.error(f'Importing {src_path} failed: {error}')
+            return -1
+        return 0
+
+    def run(self, root: str, dry_run: bool = False) -> list[tuple[str, str, str]]:
+        start = time.perf_counter()
+        plan = self.plan(root)
+        plan_seconds = time.perf_counter() - start
+        actions = {'move': 0, 'delete': 0, 'skip': 0}
+        for step in plan:
+            actions[step[2]] += 1
+        if dry_run:
+            for src_path, dest_path, action in plan:
+                print(f'{action:>6}  {src_path}' + (f' -> {dest_path}' if action == 'move' else ''))
+        print(f'planned {len(plan)} files in {plan_seconds:.2f}s ({len(plan) / max(plan_seconds, 1e-9):,.0f} files/s, '
+              f'{self.workers} workers): {actions["move"]} to move, {actions["delete"]} to delete, {actions["skip"]} already in place')
+        if dry_run:
+            return plan
+        start = time.perf_counter()
+        # create every destination folder once up front instead of checking it for each file
+        self.directory_cache.seed(self.config.destination_directories())
+        for directory in sorted({os.path.dirname(dest_path) for _, dest_path, action in plan if action == 'move'}):
+            self.directory_cache.ensure(directory)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.config.move_workers) as executor:
+            results = list(executor.map(self.execute, plan))
+        seconds = time.perf_counter() - start
+        moved_bytes = sum(size for size in results if size > 0)
+        print(f'imported {len(plan) - results.count(-1)} files, {results.count(-1)} failed, {moved_bytes} bytes in {seconds:.2f}s '
+              f'({moved_bytes / 1048576 / max(seconds, 1e-9):.1f} MiB/s), {self.duplicate_resolver.duplicates} already in the library')
+        self.duplicate_resolver.close()
+        return plan
+
 # Logger Setup
 def setup_logger(config: FormatterConfig) -> logging.Logger:
     logger = logging.getLogger('FileFormatterDaemon')
     logger.setLevel(config.log_level)
+    # the level is only set on the logger, so a reloaded log_level reaches the file too
     log_file_handler = logging.handlers.RotatingFileHandler(os.path.join(config.log_location, 'file_formatter.log'), maxBytes=262144, backupCount=4)
-    log_file_handler.setLevel(config.log_level)
     log_file_format = logging.Formatter('%(asctime)s - %(message)s')
     log_file_handler.setFormatter(log_file_format)
     logger.addHandler(log_file_handler)
     return logger
 
+def setup_console_logger(config: FormatterConfig) -> logging.Logger:
+    logger = logging.getLogger('FileFormatterImport')
+    logger.setLevel(config.log_level)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    logger.addHandler(console_handler)
+    return logger
+
 # Main Execution
-def main():
-    config = FormatterConfig()
+def main(argv: list[str] = None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='plexformatter', description='Copy movie and tv show files into a Plex compatible folder.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log debug messages')
+    parser.add_argument('-c', '--config', default=None, help='TOML settings file, reloaded when it changes')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='watch the configured folder (default)')
+    import_parser = subparsers.add_parser('import', help='reorganize an existing folder in one pass')
+    import_parser.add_argument('directory')
+    import_parser.add_argument('--dry-run', action='store_true', help='print the plan without touching any files')
+    import_parser.add_argument('--workers', type=int, default=None, help='parser processes (default: cpu count)')
+    subparsers.add_parser('index', help='fingerprint the library so duplicates are recognised without hashing it again')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config) if args.config else FormatterConfig()
+    if args.verbose:
+        config.log_level = logging.DEBUG
+    if args.command == 'import':
+        BatchImporter(config, setup_console_logger(config), args.workers).run(args.directory, args.dry_run)
+        return
+    if args.command == 'index':
+        if config.library_index_location is None:
+            parser.error('library_index_location is not set, the index would not be kept')
+        index = LibraryIndex(config.library_index_location, config.fingerprint_block_size)
+        start = time.perf_counter()
+        count = sum(index.scan(directory) for directory in dict.fromkeys(config.destination_directories()) if os.path.isdir(directory))
+        print(f'indexed {count} files in {time.perf_counter() - start:.2f}s, hashed {index.hashed}')
+        index.close()
+        return
     logger = setup_logger(config)
+    if config.watch_roots:
+        if config.runtime == 'asyncio':
+            logger.warning('the asyncio runtime watches a single directory, using the threaded runtime for watch_roots')
+        DaemonGroup(config, logger).start()
+        return
     file_formatter = FileFormatter(config, logger)
     daemon = Daemon(config, file_formatter, logger)
-    daemon.start()
+    if config.runtime == 'asyncio':
+        import asyncio
+        asyncio.run(AsyncRuntime(daemon).run())
+    else:
+        daemon.start()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import plexformatter
+
+SAMPLE_NAMES = [
+    'Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4',
+    'Stranger.Things.S01E01.1080p.BluRay.x265-RARBG.mp4',
+    'The.Office.US.S05.E14.Stress.Relief.720p.WEBRip.x264.mkv',
+    'Blade Runner 2049 (2017) [2160p] [4K] [HEVC].mkv',
+    'some_home_video_final_v2.avi',
+    'Show.Name.S10E22.HDTV.x264.nfo',
+]
+
+TITLE_WORDS = [
+    'the', 'a', 'of', 'night', 'dark', 'star', 'city', 'last', 'house', 'river', 'blood', 'king', 'queen', 'lost',
+    'secret', 'war', 'love', 'ghost', 'storm', 'black', 'mirror', 'office', 'breaking', 'bad', 'stranger', 'things',
+    'crown', 'wire', 'alien', 'matrix', 'empire', 'legend', 'shadow', 'iron', 'silver', 'winter', 'summer', 'road',
+]
+RELEASE_TAGS = [
+    '1080p', '720p', '2160p', 'BluRay', 'WEB-DL', 'WEBRip', 'HDTV', 'x264', 'x265', 'HEVC', 'AMZN', 'DTS-HD.MA',
+    'PROPER', 'REMASTERED', '10bit', 'HDR', 'DDP5.1', 'AAC', 'REPACK',
+]
+RELEASE_GROUPS = ['RARBG', 'NTb', 'FLUX', 'SPARKS', 'GalaxyRG', 'YIFY', 'EVO', 'CtrlHD']
+EXTENSIONS = ['mkv'] * 8 + ['mp4'] * 4 + ['avi', 'm4v', 'srt', 'nfo', 'txt', 'exe', 'sfv', 'jpg']
+
+# Legacy Class - the multi-split pipeline the parser replaced, kept as a baseline
+class LegacyFileFormatter(plexformatter.FileFormatter):
+    def change_symbols(self, word: str, char: chr ='') -> str:
+        return ''.join([self.convert_symbol(character, char) for character in word])
+
+    def find_year(self, file_name: str) -> str:
+        for word in file_name.split(' ')[1:]:
+            if len(word) == 4 and word.isdigit() and not self.is_tag(word):
+                return word
+        return None
+
+    def find_episode_info(self, file_name: str) -> list[str]:
+        season = None
+        episode = None
+        for word in file_name.split(' '):
+            if len(word) == 3:
+                if word[0].lower() == 's' and word[1].isdigit() and word[2].isdigit():
+                    season = word
+                elif word[0].lower() == 'e' and word[1].isdigit() and word[2].isdigit():
+                    episode = word
+                if season and episode:
+                    return [season, episode]
+            elif len(word) == 6:
+                if (word[0].lower() == 's' and word[1].isdigit() and word[2].isdigit()
+                    and word[3].lower() == 'e' and word[4].isdigit() and word[5].isdigit()):
+                    return [word[:3], word[3:]]
+        return None
+
+    def format_filename(self, file_name: str) -> str:
+        file_name_no_extension, file_extension = self.split_extension(file_name)
+        name_parts = [part for part in self.change_symbols(file_name_no_extension.lower(), ' ').split(' ') if part != '']
+        for index, part in enumerate(name_parts):
+            if self.is_tag(part):
+                name_parts = name_parts[:index]
+                break
+        return ' '.join(name_parts) + file_extension
+
+    def create_destination_path(self, file_name: str, parsed: plexformatter.ParsedFilename = None) -> str:
+        if self.is_video(file_name):
+            file_name_no_extension, file_extension = self.split_extension(file_name)
+            episode_info = self.find_episode_info(file_name_no_extension)
+            if episode_info:
+                show_name = file_name_no_extension[:file_name_no_extension.find(episode_info[0])-1].title()
+                return os.path.join(self.config.show_destination_directory, show_name,
+                                    f'Season {episode_info[0][1:]}',
+                                    show_name + f' - {episode_info[0]}{episode_info[1]}' + file_extension)
+            year = self.find_year(file_name_no_extension)
+            if year:
+                movie_name = file_name_no_extension[:file_name_no_extension.find(year)].title() + f'({year})'
+                return os.path.join(self.config.movie_destination_directory, movie_name, movie_name + file_extension)
+            return os.path.join(self.config.misc_destination_directory, file_name)
+        return os.path.join(self.config.non_video_destination_directory, file_name)
+
+def generate_release_names(count: int, seed: int = 0) -> list[str]:
+    generator = random.Random(seed)
+    names = []
+    for _ in range(count):
+        title = [word.title() for word in generator.choices(TITLE_WORDS, k=generator.randint(1, 5))]
+        kind = generator.random()
+        if kind < 0.55:
+            season = generator.randint(1, 15)
+            episode = generator.randint(1, 24)
+            info = [f'S{season:02}E{episode:02}'] if generator.random() < 0.85 else [f'S{season:02}', f'E{episode:02}']
+        elif kind < 0.9:
+            info = [str(generator.randint(1950, 2025))]
+        else:
+            info = []
+        tags = generator.sample(RELEASE_TAGS, generator.randint(0, 5))
+        separator = generator.choice(['.', '.', '.', ' ', '_'])
+        name = separator.join(title + info + tags)
+        if tags and generator.random() < 0.8:
+            name += '-' + generator.choice(RELEASE_GROUPS)
+        names.append(name + '.' + generator.choice(EXTENSIONS))
+    return names
+
+def time_per_item(function, items: list, repeat: int) -> dict:
+    best = min(timeit.repeat(lambda: function(items), repeat=repeat, number=1))
+    per_item = best / len(items)
+    return {'items': len(items), 'seconds': best, 'us_per_item': per_item * 1e6, 'items_per_second': 1 / per_item}
+
+def legacy_pipeline(formatter: plexformatter.FileFormatter, names: list[str]):
+    for name in names:
+        formatted_name = formatter.format_filename(name)
+        formatter.create_destination_path(formatted_name)
+
+def parser_pipeline(formatter: plexformatter.FileFormatter, names: list[str]):
+    for name in names:
+        parsed = formatter.parse_filename(name)
+        formatter.create_destination_path(parsed.formatted_name, parsed)
+
+def bench_parse(names: list[str], repeat: int) -> dict:
+    config = plexformatter.FormatterConfig()
+    logger = logging.getLogger(__name__)
+    legacy = LegacyFileFormatter(config, logger, plexformatter.ParseCache(0))
+    formatter = plexformatter.FileFormatter(config, logger, plexformatter.ParseCache(len(names)))
+    formatted_names = [formatter.format_filename(name) for name in names]
+    results = {
+        'legacy_pipeline': time_per_item(lambda items: legacy_pipeline(legacy, items), names, repeat),
+        'parser_pipeline': time_per_item(lambda items: parser_pipeline(formatter, items), names, repeat),
+        'parse_filename': time_per_item(lambda items: [formatter.parse_filename(name) for name in items], names, repeat),
+        'format_filename': time_per_item(lambda items: [formatter.format_filename(name) for name in items], names, repeat),
+        'create_destination_path': time_per_item(lambda items: [formatter.create_destination_path(name) for name in items],
+                                                 formatted_names, repeat),
+        'is_video': time_per_item(lambda items: [formatter.is_video(name) for name in items], names, repeat),
+    }
+    formatter.cache = plexformatter.ParseCache(len(names))
+    results['resolve_cold'] = time_per_item(lambda items: [formatter.resolve(name) for name in items], names, 1)
+    results['resolve_warm'] = time_per_item(lambda items: [formatter.resolve(name) for name in items], names, repeat)
+    return results
+
+def create_config(root: str) -> plexformatter.FormatterConfig:
+    config = plexformatter.FormatterConfig()
+    for name in ['watch', 'show', 'movie', 'misc', 'non_video']:
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    config.watch_directory = os.path.join(root, 'watch')
+    config.show_destination_directory = os.path.join(root, 'show')
+    config.movie_destination_directory = os.path.join(root, 'movie')
+    config.misc_destination_directory = os.path.join(root, 'misc')
+    config.non_video_destination_directory = os.path.join(root, 'non_video')
+    config.log_location = root
+    return config
+
+def build_tree(root: str, names: list[str], empty_directories: int, depth: int = 3, seed: int = 0):
+    generator = random.Random(seed)
+    folders = [root]
+    for index, name in enumerate(names):
+        if index % 8 == 0:
+            folders.append(os.path.join(root, plexformatter.SYMBOL_PATTERN.sub('.', name)[:40] + f'.{index}'))
+            os.makedirs(folders[-1], exist_ok=True)
+        with open(os.path.join(generator.choice(folders), name), 'wb') as file:
+            file.write(b'x' * 64)
+    for index in range(empty_directories):
+        path = os.path.join(root, f'empty.{index}', *[f'nested.{level}' for level in range(generator.randint(0, depth))])
+        os.makedirs(path, exist_ok=True)
+
+def bench_filesystem(file_count: int, empty_directories: int, latency_files: int) -> dict:
+    logger = logging.getLogger(__name__)
+    root = tempfile.mkdtemp(prefix='plexformatter-bench-')
+    results = {}
+    try:
+        config = create_config(root)
+        config.completion_detector = 'delay'
+        names = generate_release_names(file_count, seed=1)
+        build_tree(config.watch_directory, names, empty_directories)
+        daemon = plexformatter.Daemon(config, plexformatter.FileFormatter(config, logger), logger)
+        daemon.delay_before_moving = 0
+
+        start = time.perf_counter()
+        daemon.find_files(config.watch_directory)
+        results['find_files'] = {'files': len(daemon.tracked_files), 'seconds': time.perf_counter() - start}
+
+        start = time.perf_counter()
+        daemon.clean_watch_folder()
+        results['clean_watch_folder_cold'] = {'empty_directories': empty_directories, 'seconds': time.perf_counter() - start}
+        start = time.perf_counter()
+        daemon.clean_watch_folder()
+        results['clean_watch_folder_warm'] = {'seconds': time.perf_counter() - start}
+
+        time.sleep(0.01)
+        start = time.perf_counter()
+        daemon.check_tracked_files()
+        dispatched = time.perf_counter() - start
+        daemon.move_pool.join()
+        moved = time.perf_counter() - start
+        results['check_tracked_files'] = {'files': file_count, 'dispatch_seconds': dispatched, 'move_seconds': moved,
+                                          'files_per_second': file_count / moved}
+        daemon.move_pool.shutdown()
+        results['end_to_end'] = bench_latency(root, latency_files)
+    finally:
+        shutil.rmtree(root)
+    return results
+
+def bench_latency(root: str, file_count: int) -> dict:
+    logger = logging.getLogger(__name__)
+    config = create_config(os.path.join(root, 'latency'))
+    config.stability_quiet_time = 0.5
+    config.stability_min_interval = 0.1
+    daemon = plexformatter.Daemon(config, plexformatter.FileFormatter(config, logger), logger)
+    runtime = plexformatter.AsyncRuntime(daemon)
+    thread = threading.Thread(target=asyncio.run, args=(runtime.run(),))
+    thread.start()
+    while daemon.observer.ident is None or not daemon.observer.is_alive():
+        time.sleep(0.01)
+    time.sleep(0.1)
+    latencies = []
+    for index in range(file_count):
+        name = f'Latency.Show.S01E{index + 1:02}.720p.mkv'
+        destination = os.path.join(config.show_destination_directory, 'Latency Show', 'Season 01', f'Latency Show - s01e{index + 1:02}.mkv')
+        start = time.perf_counter()
+        with open(os.path.join(config.watch_directory, name), 'wb') as file:
+            file.write(b'x' * 1024)
+        while not os.path.exists(destination) and time.perf_counter() - start < 30:
+            time.sleep(0.005)
+        latencies.append(time.perf_counter() - start)
+    runtime.stop()
+    thread.join()
+    latencies.sort()
+    return {'files': file_count, 'quiet_time': config.stability_quiet_time, 'min_seconds': latencies[0],
+            'median_seconds': latencies[len(latencies) // 2], 'max_seconds': latencies[-1]}
+
+# one-shot parse as a batch tool would do it, reports its own import and parse time
+COLD_START_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import plexformatter
+imported = time.perf_counter()
+plexformatter.FileFormatter(plexformatter.FormatterConfig(), None).resolve(sys.argv[1])
+print(imported - start, time.perf_counter() - imported, ' '.join(sorted({'watchdog', 'sqlite3', 'asyncio'} & sys.modules.keys())))
+'''
+
+def bench_startup(repeat: int) -> dict:
+    wall_times = []
+    import_times = []
+    parse_times = []
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, SAMPLE_NAMES[0]], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        wall_times.append(time.perf_counter() - start)
+        import_times.append(float(output[0]))
+        parse_times.append(float(output[1]))
+    return {'process_seconds': min(wall_times), 'import_seconds': min(import_times), 'first_parse_seconds': min(parse_times),
+            'heavy_modules_loaded': ' '.join(output[2:]) or 'none'}
+
+def environment() -> dict:
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = ''
+    return {'revision': revision, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def print_results(results: dict, prefix: str = ''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f'{prefix}{key}:')
+            print_results(value, prefix + '  ')
+        elif isinstance(value, float):
+            print(f'{prefix}{key}: {value:,.6g}')
+        else:
+            print(f'{prefix}{key}: {value}')
+
+def main():
+    parser = argparse.ArgumentParser(description='plexformatter benchmarks')
+    parser.add_argument('--suite', choices=['parse', 'filesystem', 'startup', 'all'], default='all')
+    parser.add_argument('--names', type=int, default=20000, help='synthetic release names for the parse suite')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--files', type=int, default=2000, help='files in the generated watch folder')
+    parser.add_argument('--empty-directories', type=int, default=500)
+    parser.add_argument('--latency-files', type=int, default=5)
+    parser.add_argument('--json', metavar='PATH', help="write machine readable results, '-' for stdout")
+    args = parser.parse_args()
+
+    results = {'environment': environment()}
+    if args.suite in ('parse', 'all'):
+        results['parse'] = bench_parse(generate_release_names(args.names), args.repeat)
+    if args.suite in ('startup', 'all'):
+        results['startup'] = bench_startup(args.repeat)
+    if args.suite in ('filesystem', 'all'):
+        results['filesystem'] = bench_filesystem(args.files, args.empty_directories, args.latency_files)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_results(results)
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
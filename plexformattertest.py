@@ -4,7 +4,18 @@ import os
 import os.path
 import shutil
 import time
+import tempfile
+import io
+import contextlib
+import urllib.request
+import asyncio
+import threading
+import subprocess
+import sys
+import signal
+import zipfile
 import watchdog
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileDeletedEvent, FileMovedEvent, FileClosedEvent
 import plexformatter
 
 class FileFormatterTestCase(unittest.TestCase):
@@ -34,6 +45,14 @@ class FileFormatterTestCase(unittest.TestCase):
     def test_is_tag(self):
         self.assertTrue(self.formatter.is_tag('1080p'), 'Matching Word returned False')
         self.assertFalse(self.formatter.is_tag('test'), 'Non-matching word returned True')
+        self.assertTrue(self.formatter.is_tag('WEB DL'), 'Matching multi-word tag returned False')
+
+    def test_multi_token_tags(self):
+        self.config.tags.append('Blu-Ray Remux')
+        formatter = plexformatter.FileFormatter(self.config, self.logger)
+        self.assertEqual(formatter.format_filename('Show.Name.S01E02.WEB-DL.DDP5.1.mkv'), 'show name s01e02.mkv', 'Failed to match multi-word tag')
+        self.assertEqual(formatter.format_filename('Heat.1995.Blu.Ray.Remux.mkv'), 'heat 1995.mkv', 'Failed to match configured multi-word tag')
+        self.assertEqual(formatter.format_filename('The.Web.Dlux.2001.mkv'), 'the web dlux 2001.mkv', 'Matched a partial multi-word tag')
     
     def test_find_year(self):
         self.assertEqual(self.formatter.find_year('test 1080p 1080 1995'), '1995', 'Failed to parse year')
@@ -54,6 +73,18 @@ class FileFormatterTestCase(unittest.TestCase):
                         'stranger things s01e01.mp4',
                         'Failed to format file name')
     
+    def test_parse_filename(self):
+        parsed = self.formatter.parse_filename('Stranger.Things.S01E01.1080p.BluRay.x265-RARBG.mp4')
+        self.assertListEqual(parsed.tokens, ['stranger', 'things', 's01e01'], 'Failed to tokenize file name')
+        self.assertEqual(parsed.first_tag_index, 3, 'Failed to find first tag')
+        self.assertEqual([parsed.season, parsed.episode, parsed.extension], ['s01', 'e01', '.mp4'], 'Failed to parse episode info')
+        parsed = self.formatter.parse_filename('Alien.1979.PROPER.mp4')
+        self.assertEqual(parsed.year, '1979', 'Failed to parse year')
+        self.assertEqual(parsed.formatted_name, 'alien 1979.mp4', 'Failed to format file name')
+        self.assertEqual(self.formatter.create_destination_path(parsed.formatted_name, parsed),
+                        '/movie/Alien (1979)/Alien (1979).mp4',
+                        'Failed to reuse parsed file name')
+
     def test_create_destination_path(self):
         self.assertEqual(self.formatter.create_destination_path('Alien 1979.mp4'),
                         '/movie/Alien (1979)/Alien (1979).mp4',
@@ -68,23 +99,777 @@ class FileFormatterTestCase(unittest.TestCase):
     def test_add_file(self):
         self.daemon.add_file('/Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4')
         correct_file = ['/Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4', 'alien 1979.mp4', '/movie/Alien (1979)/Alien (1979).mp4']
-        self.assertListEqual(correct_file, [self.daemon.tracked_files[0].src_path, self.daemon.tracked_files[0].file_name, self.daemon.tracked_files[0].dest_path])
+        tracked_file = self.daemon.tracked_files.get(correct_file[0])
+        self.assertListEqual(correct_file, [tracked_file.src_path, tracked_file.file_name, tracked_file.dest_path])
 
         self.daemon.add_file('/Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.exe')
         correct_file = ['/Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.exe', 'alien 1979.exe', '/non_video/alien 1979.exe']
-        self.assertListEqual(correct_file, [self.daemon.tracked_files[1].src_path, self.daemon.tracked_files[1].file_name, self.daemon.tracked_files[1].dest_path])
+        tracked_file = self.daemon.tracked_files.get(correct_file[0])
+        self.assertListEqual(correct_file, [tracked_file.src_path, tracked_file.file_name, tracked_file.dest_path])
 
         self.daemon.add_file('/Alien.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4')
         correct_file = ['/Alien.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4', 'alien.mp4', '/misc/alien.mp4']
-        self.assertListEqual(correct_file, [self.daemon.tracked_files[2].src_path, self.daemon.tracked_files[2].file_name, self.daemon.tracked_files[2].dest_path])
+        tracked_file = self.daemon.tracked_files.get(correct_file[0])
+        self.assertListEqual(correct_file, [tracked_file.src_path, tracked_file.file_name, tracked_file.dest_path])
+        self.assertEqual(len(self.daemon.tracked_files), 3)
+
+class ParseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.config = plexformatter.FormatterConfig()
+        self.config.movie_destination_directory = '/movie/'
+        self.temp_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def test_lru_eviction(self):
+        cache = plexformatter.ParseCache(max_size=2)
+        cache.put('fp', 'a', ('a', '/a'))
+        cache.put('fp', 'b', ('b', '/b'))
+        cache.get('fp', 'a')
+        cache.put('fp', 'c', ('c', '/c'))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('fp', 'b'), 'least recently used entry was not evicted')
+        self.assertEqual(cache.get('fp', 'a'), ('a', '/a'))
+
+    def test_resolve_uses_cache(self):
+        formatter = plexformatter.FileFormatter(self.config, self.logger)
+        resolved = formatter.resolve('Alien.1979.1080p.mp4')
+        self.assertEqual(resolved, ('alien 1979.mp4', '/movie/Alien (1979)/Alien (1979).mp4'))
+        self.assertEqual(formatter.resolve('Alien.1979.1080p.mp4'), resolved)
+        self.assertEqual((formatter.cache.hits, formatter.cache.misses), (1, 1))
+
+    def test_config_change_invalidates(self):
+        formatter = plexformatter.FileFormatter(self.config, self.logger)
+        formatter.resolve('Alien.1979.Directors.Cut.mp4')
+        self.config.tags.append('directors')
+        self.config.movie_destination_directory = '/films/'
+        formatter.reload_config()
+        self.assertEqual(formatter.resolve('Alien.1979.Directors.Cut.mp4'), ('alien 1979.mp4', '/films/Alien (1979)/Alien (1979).mp4'))
+
+    def test_reload_keeps_unaffected_entries(self):
+        self.config.show_destination_directory = '/show/'
+        formatter = plexformatter.FileFormatter(self.config, self.logger)
+        formatter.resolve('Alien.1979.Directors.Cut.mp4')
+        formatter.resolve('Stranger.Things.S01E01.1080p.mkv')
+        formatter.resolve('Heat.1995.mkv')
+        self.config.tags.append('directors')
+        self.config.movie_destination_directory = '/films/'
+        formatter.reload_config()
+        misses = formatter.cache.misses
+        self.assertEqual(formatter.resolve('Heat.1995.mkv'), ('heat 1995.mkv', '/films/Heat (1995)/Heat (1995).mkv'))
+        self.assertEqual(formatter.resolve('Stranger.Things.S01E01.1080p.mkv')[1], '/show/Stranger Things/Season 01/Stranger Things - s01e01.mkv')
+        self.assertEqual(formatter.cache.misses, misses, 'unaffected names were parsed again')
+        formatter.resolve('Alien.1979.Directors.Cut.mp4')
+        self.assertEqual(formatter.cache.misses, misses + 1, 'name containing the new tag was not invalidated')
+
+    def test_reload_shared_destination(self):
+        formatter = plexformatter.FileFormatter(self.config, self.logger)
+        formatter.resolve('Heat.1995.mkv')
+        self.config.misc_destination_directory = '/misc/'
+        self.config.movie_destination_directory = '/films/'
+        formatter.reload_config()
+        # /movie/ was shared with misc and show, the cached path cannot be rewritten
+        self.assertEqual(formatter.resolve('Heat.1995.mkv')[1], '/films/Heat (1995)/Heat (1995).mkv')
+
+    def test_persistent_store(self):
+        location = os.path.join(self.temp_directory, 'parse_cache.db')
+        formatter = plexformatter.FileFormatter(self.config, self.logger, plexformatter.ParseCache(16, location))
+        resolved = formatter.resolve('Alien.1979.1080p.mp4')
+        formatter.cache.close()
+        cache = plexformatter.ParseCache(16, location)
+        self.assertEqual(cache.get(formatter.lookups.fingerprint, 'Alien.1979.1080p.mp4'), resolved, 'cache did not survive a restart')
+        self.assertIsNone(cache.get('other', 'Alien.1979.1080p.mp4'))
+        cache.close()
+
+class ConfigFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.temp_directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_directory, 'plexformatter.toml')
+        self.write("tags = ['x264', 'web dl']\nlog_level = 'debug'\n"
+                   "[[watch_roots]]\nwatch_directory = '/downloads'\nstability_quiet_time = 120\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def write(self, text: str):
+        with open(self.path, 'w') as file:
+            file.write(text)
+
+    def test_load_config(self):
+        config = plexformatter.load_config(self.path)
+        self.assertEqual(config.tags, ['x264', 'web dl'])
+        self.assertEqual(config.log_level, logging.DEBUG)
+        self.assertEqual(config.watch_roots, [plexformatter.WatchRoot('/downloads', stability_quiet_time=120)])
+        self.assertEqual(plexformatter.create_completion_detector(config.root_configs()[0]).delay, 120,
+                         'root override did not reach the completion detector')
+        self.assertEqual(config.config_file, self.path)
+        self.write("tag = ['x264']\n")
+        self.assertRaises(ValueError, plexformatter.load_config, self.path)
+
+    def test_watcher_reloads_changes(self):
+        watcher = plexformatter.ConfigWatcher(self.path, self.logger, 0)
+        self.assertIsNone(watcher.poll(), 'unchanged file was reloaded')
+        self.write("tags = ['x265']\n")
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(watcher.poll().tags, ['x265'])
+        self.write("tags = ['x265'\n")
+        os.utime(self.path, ns=(1, 1))
+        self.assertIsNone(watcher.poll(), 'broken file replaced the configuration')
+
+    def test_daemon_reload(self):
+        config = plexformatter.FormatterConfig()
+        config.watch_directory = self.temp_directory
+        daemon = plexformatter.Daemon(config, plexformatter.FileFormatter(config, self.logger), self.logger)
+        file_path = os.path.join(self.temp_directory, 'Alien.1979.mp4')
+        with open(file_path, 'w+') as file:
+            file.write('test')
+        daemon.add_file(file_path)
+        lookups = daemon.file_formatter.lookups
+        reloaded = plexformatter.FormatterConfig()
+        reloaded.watch_directory = '/elsewhere'
+        reloaded.tags = ['x264']
+        reloaded.movie_destination_directory = '/library/movies'
+        reloaded.stability_quiet_time = 30
+        with self.assertLogs(self.logger, 'WARNING'):
+            daemon.reload_config(reloaded)
+        daemon.move_pool.shutdown()
+        self.assertIsNot(daemon.file_formatter.lookups, lookups)
+        self.assertEqual(daemon.file_formatter.lookups.tags, frozenset(['x264']))
+        self.assertEqual(daemon.delay_before_moving, 30)
+        self.assertEqual(daemon.tracked_files.get(file_path).dest_path, '/library/movies/Alien (1979)/Alien (1979).mp4',
+                         'tracked file kept the destination from the old settings')
+        self.assertEqual(daemon.config.watch_directory, self.temp_directory, 'setting that needs a restart was applied')
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics = plexformatter.Metrics()
+        self.metrics.histogram('test_seconds', 'Test histogram.', (0.1, 1))
+        self.metrics.counter('test_total', 'Test counter.')
+        self.metrics.register('gauge', 'test_depth', 'Test gauge.', lambda: 3)
+
+    def test_render(self):
+        self.metrics.observe('test_seconds', 0.05)
+        self.metrics.observe('test_seconds', 0.5)
+        self.metrics.observe('test_seconds', 5)
+        self.metrics.inc('test_total', 2)
+        lines = self.metrics.render().splitlines()
+        for line in ['# TYPE test_seconds histogram', 'test_seconds_bucket{le="0.1"} 1', 'test_seconds_bucket{le="1"} 2',
+                     'test_seconds_bucket{le="+Inf"} 3', 'test_seconds_count 3', 'test_total 2', 'test_depth 3']:
+            self.assertIn(line, lines)
+
+    def test_unregister(self):
+        function = lambda: 4
+        self.metrics.register('gauge', 'test_depth', 'Test gauge.', function)
+        self.assertIn('test_depth 7', self.metrics.render())
+        self.metrics.unregister('test_depth', function)
+        self.assertIn('test_depth 3', self.metrics.render())
+
+    def test_server(self):
+        server = plexformatter.MetricsServer(self.metrics, '127.0.0.1', 0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                self.assertIn('test_depth 3', response.read().decode())
+        finally:
+            server.stop()
+
+    def test_parse_is_timed(self):
+        formatter = plexformatter.FileFormatter(plexformatter.FormatterConfig(), logging.getLogger(__name__))
+        count = plexformatter.METRICS.histograms['plexformatter_parse_filename_seconds'].count
+        formatter.format_filename('Alien.1979.mp4')
+        self.assertEqual(plexformatter.METRICS.histograms['plexformatter_parse_filename_seconds'].count, count + 1)
+
+class TrackedFileRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = plexformatter.TrackedFileRegistry()
+
+    def create_file(self, src_path: str, next_check: float) -> plexformatter.TrackedFile:
+        file = plexformatter.TrackedFile()
+        file.src_path = src_path
+        file.next_check = next_check
+        self.registry.add(file)
+        return file
+
+    def test_touch(self):
+        self.create_file('/a.mkv', 100)
+        self.assertTrue(self.registry.touch('/a.mkv', 150))
+        self.assertEqual(self.registry.get('/a.mkv').last_modification, 150)
+        self.assertFalse(self.registry.touch('/missing.mkv', 150))
+
+    def test_pop_due(self):
+        file_a = self.create_file('/a.mkv', 160)
+        self.create_file('/b.mkv', 170)
+        self.create_file('/c.mkv', 180)
+        file_a.next_check = 190
+        self.assertListEqual([file.src_path for file in self.registry.pop_due(175)], ['/b.mkv'])
+        self.assertListEqual([file.src_path for file in self.registry.pop_due(195)], ['/c.mkv', '/a.mkv'])
+        self.assertEqual(len(self.registry), 3, 'due files should stay registered until removed')
+        self.assertListEqual(self.registry.pop_due(1000), [], 'due files were returned twice')
+
+    def test_reschedule(self):
+        file = self.create_file('/a.mkv', 100)
+        self.assertListEqual(self.registry.pop_due(100), [file])
+        file.next_check = 200
+        self.registry.reschedule(file)
+        self.assertListEqual(self.registry.pop_due(150), [])
+        self.assertListEqual(self.registry.pop_due(200), [file])
+
+    def test_add_replaces_existing_path(self):
+        self.create_file('/a.mkv', 100)
+        self.create_file('/a.mkv', 200)
+        self.assertEqual(len(self.registry), 1)
+        self.assertListEqual(self.registry.pop_due(150), [])
+        self.assertEqual(len(self.registry.pop_due(250)), 1)
+
+    def test_remove(self):
+        self.create_file('/a.mkv', 100)
+        self.assertIsNotNone(self.registry.remove('/a.mkv'))
+        self.assertNotIn('/a.mkv', self.registry)
+        self.assertListEqual(self.registry.pop_due(1000), [])
+
+class CompletionDetectorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = plexformatter.FormatterConfig()
+        self.config.stability_quiet_time = 3
+        self.config.stability_min_interval = 1
+        self.config.stability_max_interval = 8
+        self.temp_directory = tempfile.mkdtemp()
+        self.file = plexformatter.TrackedFile()
+        self.file.src_path = os.path.join(self.temp_directory, 'a.mkv')
+        self.write('a')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def write(self, data: str):
+        with open(self.file.src_path, 'a+') as file:
+            file.write(data)
+
+    def test_quiet_period(self):
+        detector = plexformatter.CompletionDetector(self.config)
+        self.file.last_modification = 100
+        self.assertEqual(detector.first_check(self.file), 160)
+        self.assertEqual(detector.check(self.file, 150), 160)
+        self.assertIsNone(detector.check(self.file, 161))
+
+    def test_stability(self):
+        detector = plexformatter.StabilityDetector(self.config)
+        self.file.last_modification = 0
+        start = time.time()
+        self.assertEqual(detector.first_check(self.file), self.file.stable_since + 3)
+        self.write('b')
+        self.assertEqual(detector.check(self.file, start + 3), start + 6, 'growing file was not checked again')
+        self.write('c')
+        self.assertEqual(detector.check(self.file, start + 6), start + 10, 'check interval did not back off')
+        self.assertIsNone(detector.check(self.file, start + 10), 'stable file was not complete')
+
+    def test_close_event_shortens_quiet_time(self):
+        detector = plexformatter.StabilityDetector(self.config)
+        self.file.last_modification = 0
+        detector.first_check(self.file)
+        self.file.closed = True
+        self.assertIsNone(detector.check(self.file, self.file.stable_since + 1))
+
+    def test_stalled_download_waits_full_quiet_time(self):
+        detector = plexformatter.StabilityDetector(plexformatter.FormatterConfig())
+        self.assertGreaterEqual(detector.delay, 60)
+        self.file.last_modification = 0
+        detector.first_check(self.file)
+        self.assertIsNotNone(detector.check(self.file, self.file.stable_since + 10), 'stalled download was complete')
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fdinfo'), 'requires /proc')
+    def test_handle_check_shortens_quiet_time(self):
+        self.config.check_open_handles = True
+        detector = plexformatter.StabilityDetector(self.config)
+        self.file.last_modification = 0
+        detector.first_check(self.file)
+        with open(self.file.src_path, 'a'):
+            self.assertIsNotNone(detector.check(self.file, self.file.stable_since + 1), 'file open for writing was complete')
+        self.assertIsNone(detector.check(self.file, self.file.stable_since + 1))
+
+    def test_unknown_detector(self):
+        self.config.completion_detector = 'quiet'
+        self.assertRaises(ValueError, plexformatter.create_completion_detector, self.config)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fdinfo'), 'requires /proc')
+    def test_open_handles(self):
+        with open(self.file.src_path, 'a'):
+            self.assertTrue(plexformatter.is_open_for_writing(self.file.src_path))
+        with open(self.file.src_path, 'r'):
+            self.assertFalse(plexformatter.is_open_for_writing(self.file.src_path))
+
+class TransferEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.config = plexformatter.FormatterConfig()
+        self.config.transfer_chunk_size = 1024
+        self.temp_directory = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.temp_directory, 'src.mkv')
+        self.dest_path = os.path.join(self.temp_directory, 'dest.mkv')
+        with open(self.src_path, 'wb') as file:
+            file.write(os.urandom(10000))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def read(self, path: str) -> bytes:
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_same_device_rename(self):
+        data = self.read(self.src_path)
+        result = plexformatter.TransferEngine(self.config, self.logger).transfer(self.src_path, self.dest_path)
+        self.assertEqual((result.method, result.bytes), ('rename', 10000))
+        self.assertFalse(os.path.exists(self.src_path))
+        self.assertEqual(self.read(self.dest_path), data)
+
+    def test_chunked_copy(self):
+        engine = plexformatter.TransferEngine(self.config, self.logger)
+        method = engine.copy(self.src_path, self.dest_path)
+        self.assertIn(method, ['copy_file_range', 'sendfile', 'copyfileobj'])
+        self.assertEqual(self.read(self.dest_path), self.read(self.src_path))
+        self.assertFalse(os.path.exists(self.dest_path + '.part'), 'partial file was left behind')
+
+    def test_hardlink_keeps_source(self):
+        self.config.transfer_mode = 'hardlink'
+        engine = plexformatter.TransferEngine(self.config, self.logger)
+        self.assertEqual(engine.transfer(self.src_path, self.dest_path).method, 'hardlink')
+        self.assertTrue(os.path.samefile(self.src_path, self.dest_path))
+        self.assertEqual(engine.transfer(self.src_path, self.dest_path).method, 'hardlink', 'existing link was not accepted')
+
+    def test_hardlink_replaces_existing_file(self):
+        self.config.transfer_mode = 'hardlink'
+        engine = plexformatter.TransferEngine(self.config, self.logger)
+        with open(self.dest_path, 'w') as f:
+            f.write('old')
+        self.assertEqual(engine.transfer(self.src_path, self.dest_path).method, 'hardlink')
+        self.assertTrue(os.path.samefile(self.src_path, self.dest_path))
+        self.assertFalse(os.path.exists(self.dest_path + '.link'))
+
+    def test_reflink_falls_back_to_copy(self):
+        self.config.transfer_mode = 'reflink'
+        result = plexformatter.TransferEngine(self.config, self.logger).transfer(self.src_path, self.dest_path)
+        self.assertTrue(os.path.exists(self.src_path))
+        self.assertEqual(self.read(self.dest_path), self.read(self.src_path), f'{result.method} produced a different file')
+
+    def test_resume_copy(self):
+        data = self.read(self.src_path)
+        with open(self.dest_path + '.part', 'wb') as file:
+            file.write(data[:4000] + b'garbage')
+        progress = []
+        engine = plexformatter.TransferEngine(self.config, self.logger)
+        engine.copy(self.src_path, self.dest_path, progress.append, 4000)
+        self.assertEqual(self.read(self.dest_path), data, 'resumed copy produced a different file')
+        self.assertGreater(progress[0], 4000, 'copy did not resume from the journaled offset')
+        self.assertEqual(progress[-1], 10000)
+
+class DirectoryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.mkdtemp()
+        self.cache = plexformatter.DirectoryCache()
+        self.cache.seed([self.temp_directory, os.path.join(self.temp_directory, 'missing')])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def test_seed_skips_missing_directories(self):
+        self.assertIn(self.temp_directory, self.cache)
+        self.assertNotIn(os.path.join(self.temp_directory, 'missing'), self.cache)
+
+    def test_ensure_creates_once(self):
+        season = os.path.join(self.temp_directory, 'Stranger Things', 'Season 01')
+        for _ in range(3):
+            self.cache.ensure(season)
+        self.assertTrue(os.path.isdir(season))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.cache.ensure(os.path.join(self.temp_directory, 'Stranger Things'))
+        self.assertEqual(self.cache.misses, 1, 'parent folder was not cached')
+
+    def test_invalidate_after_removal(self):
+        season = os.path.join(self.temp_directory, 'Stranger Things', 'Season 01')
+        self.cache.ensure(season)
+        shutil.rmtree(os.path.join(self.temp_directory, 'Stranger Things'))
+        self.cache.invalidate(os.path.join(self.temp_directory, 'Stranger Things'))
+        self.assertNotIn(season, self.cache)
+        self.cache.ensure(season)
+        self.assertTrue(os.path.isdir(season), 'folder was not created again after invalidation')
+
+class DuplicateResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.config = plexformatter.FormatterConfig()
+        self.config.fingerprint_block_size = 16
+        self.temp_directory = tempfile.mkdtemp()
+        self.src_path = self.create_file('Show.S01E01.PROPER.mkv', b'a' * 100)
+        self.dest_path = self.create_file('Show - s01e01.mkv', b'a' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def create_file(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.temp_directory, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_sample_fingerprint(self):
+        fingerprint = plexformatter.sample_fingerprint(self.src_path, 16)
+        self.assertEqual(fingerprint[0], 100)
+        self.assertEqual(plexformatter.sample_fingerprint(self.create_file('unsampled', b'a' * 20 + b'b' + b'a' * 79), 16), fingerprint,
+                         'bytes outside the sampled blocks were hashed')
+        self.assertNotEqual(plexformatter.sample_fingerprint(self.create_file('middle', b'a' * 50 + b'b' + b'a' * 49), 16), fingerprint)
+
+    def test_sample_stream_fingerprint(self):
+        data = bytes(range(100))
+        stream = io.BytesIO(data)
+        stream.seekable = lambda: False
+        self.assertEqual(plexformatter.sample_stream_fingerprint(stream, len(data), 16),
+                         plexformatter.sample_fingerprint(self.create_file('counting', data), 16), 'unseekable stream sampled other blocks')
+
+    def test_index_reuses_fingerprints(self):
+        index = plexformatter.LibraryIndex(os.path.join(self.temp_directory, 'library.db'), 16)
+        fingerprint = index.get(self.dest_path)
+        self.assertEqual(index.get(self.dest_path), fingerprint)
+        self.assertEqual(index.hashed, 1, 'unchanged file was hashed again')
+        with open(self.dest_path, 'ab') as file:
+            file.write(b'b')
+        self.assertNotEqual(index.get(self.dest_path), fingerprint)
+        self.assertEqual(index.hashed, 2)
+        index.close()
+
+    def test_identical_file_is_duplicate(self):
+        resolver = plexformatter.DuplicateResolver(self.config, self.logger)
+        self.assertEqual(resolver.resolve(self.src_path, self.dest_path)[:2], ('duplicate', self.dest_path))
+        self.assertEqual(resolver.resolve(self.src_path, os.path.join(self.temp_directory, 'new.mkv'))[0], 'move')
+
+    def test_policies(self):
+        with open(self.src_path, 'ab') as file:
+            file.write(b'proper')
+        expected = {'skip': ('skip', self.dest_path), 'replace': ('move', self.dest_path),
+                    'version': ('move', os.path.join(self.temp_directory, 'Show - s01e01 (2).mkv'))}
+        for policy, result in expected.items():
+            self.config.duplicate_policy = policy
+            resolver = plexformatter.DuplicateResolver(self.config, self.logger)
+            self.assertEqual(resolver.resolve(self.src_path, self.dest_path)[:2], result, f'{policy} policy')
+            resolver.release(result[1])
+        self.config.duplicate_policy = 'overwrite'
+        self.assertRaises(ValueError, plexformatter.DuplicateResolver, self.config, self.logger)
+
+    def test_versioned_path_is_reserved(self):
+        second, third = (plexformatter.DuplicateResolver.versioned_path(self.dest_path) for _ in range(2))
+        self.assertEqual(second, os.path.join(self.temp_directory, 'Show - s01e01 (2).mkv'))
+        self.assertEqual(third, os.path.join(self.temp_directory, 'Show - s01e01 (3).mkv'), 'reserved name was handed out twice')
+        plexformatter.DuplicateResolver.release(second)
+        plexformatter.DuplicateResolver.release(third)
+        self.create_file('Show - s01e01 (2).mkv.part', b'a')
+        self.assertEqual(plexformatter.DuplicateResolver.versioned_path(self.dest_path), third, 'in-flight copy was overwritten')
+        plexformatter.DuplicateResolver.release(third)
+
+class TrackedFileJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.temp_directory = tempfile.mkdtemp()
+        self.config = plexformatter.FormatterConfig()
+        self.config.watch_directory = os.path.join(self.temp_directory, 'watch')
+        self.config.misc_destination_directory = os.path.join(self.temp_directory, 'misc')
+        self.config.journal_location = os.path.join(self.temp_directory, 'journal.db')
+        self.config.stability_quiet_time = 0
+        os.mkdir(self.config.watch_directory)
+        self.daemons = []
+
+    def tearDown(self):
+        for daemon in self.daemons:
+            daemon.move_pool.shutdown()
+            daemon.journal.close()
+        shutil.rmtree(self.temp_directory)
+
+    def create_daemon(self) -> plexformatter.Daemon:
+        daemon = plexformatter.Daemon(self.config, plexformatter.FileFormatter(self.config, self.logger), self.logger)
+        self.daemons.append(daemon)
+        return daemon
+
+    def create_file(self, name: str, size: int = 10) -> str:
+        path = os.path.join(self.config.watch_directory, name)
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        return path
+
+    def test_disabled_without_location(self):
+        journal = plexformatter.TrackedFileJournal()
+        file = plexformatter.TrackedFile()
+        journal.record(file)
+        journal.progress(file, 10)
+        self.assertFalse(journal.enabled)
+        self.assertEqual(journal.load(), [])
+        self.assertEqual(file.bytes_copied, 10)
+
+    def test_restore_tracked_files(self):
+        path = self.create_file('test.mp4')
+        daemon = self.create_daemon()
+        daemon.add_file(path)
+        daemon.tracked_files.get(path).dest_path = '/journaled/test.mp4'
+        daemon.journal.record(daemon.tracked_files.get(path))
+        daemon.journal.close()
+        restored = self.create_daemon()
+        restored.restore()
+        file = restored.tracked_files.get(path)
+        self.assertIsNotNone(file, 'tracked file was not restored')
+        self.assertEqual(file.dest_path, '/journaled/test.mp4', 'restored file was parsed again')
+        self.assertLessEqual(file.next_check, time.time(), 'quiet period started over after the restart')
+
+    def test_resume_interrupted_move(self):
+        path = self.create_file('test.mp4', 10000)
+        with open(path, 'rb') as source:
+            data = source.read()
+        daemon = self.create_daemon()
+        daemon.add_file(path)
+        file = daemon.tracked_files.remove(path)
+        os.makedirs(os.path.dirname(file.dest_path))
+        with open(file.dest_path + '.part', 'wb') as partial:
+            partial.write(data[:6000])
+        daemon.journal.update_state(file, plexformatter.MoveState.MOVING)
+        daemon.journal.progress(file, 6000)
+        daemon.journal.close()
+        restored = self.create_daemon()
+        restored.restore()
+        self.assertTrue(restored.move_pool.join(5), 'move was not resumed')
+        with open(file.dest_path, 'rb') as dest:
+            self.assertEqual(dest.read(), data)
+        self.assertEqual(restored.journal.load(), [], 'finished move was left in the journal')
+
+    def test_resume_versioned_move(self):
+        def interrupted(src_path, dest_path, progress=None, resume_offset=0):
+            with open(dest_path + '.part', 'wb') as partial:
+                partial.write(data[:6000])
+            progress(6000)
+            raise OSError('interrupted')
+        self.config.duplicate_policy = 'version'
+        path = self.create_file('test.mp4', 10000)
+        with open(path, 'rb') as source:
+            data = source.read()
+        daemon = self.create_daemon()
+        daemon.add_file(path)
+        file = daemon.tracked_files.remove(path)
+        os.makedirs(os.path.dirname(file.dest_path))
+        with open(file.dest_path, 'wb') as existing:
+            existing.write(b'older release')
+        file.state = plexformatter.MoveState.MOVING
+        daemon.journal.update_state(file, file.state)
+        daemon.transfer_engine.transfer = interrupted
+        self.assertRaises(OSError, daemon.move_file, file)
+        daemon.journal.close()
+        restored = self.create_daemon()
+        # copy as a move across devices would, a rename has nothing to resume
+        restored.transfer_engine.move = restored.transfer_engine.copy
+        restored.restore()
+        self.assertTrue(restored.move_pool.join(5), 'move was not resumed')
+        self.assertListEqual(sorted(os.listdir(self.config.misc_destination_directory)), ['test (2).mp4', 'test.mp4'],
+                             'resumed move picked another versioned name')
+        with open(os.path.join(self.config.misc_destination_directory, 'test (2).mp4'), 'rb') as dest:
+            self.assertEqual(dest.read(), data)
+
+    def test_missing_files_are_dropped(self):
+        daemon = self.create_daemon()
+        daemon.add_file(self.create_file('test.mp4'))
+        daemon.journal.close()
+        os.remove(os.path.join(self.config.watch_directory, 'test.mp4'))
+        restored = self.create_daemon()
+        restored.restore()
+        self.assertEqual(len(restored.tracked_files), 0)
+        self.assertEqual(restored.journal.load(), [])
+
+class MoveWorkerPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.config = plexformatter.FormatterConfig()
+        self.config.move_retry_delay = 0.01
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def create_file(self, name: str) -> plexformatter.TrackedFile:
+        file = plexformatter.TrackedFile()
+        file.src_path = os.path.join('/watch', name)
+        file.dest_path = os.path.join('/library', name)
+        return file
+
+    def test_retry_with_backoff(self):
+        def handler(file):
+            if file.attempts < 3:
+                raise OSError('device busy')
+        pool = plexformatter.MoveWorkerPool(self.config, self.logger, handler)
+        file = self.create_file('a.mkv')
+        pool.submit(file)
+        self.assertTrue(pool.join(5))
+        self.assertEqual((file.state, file.attempts), (plexformatter.MoveState.DONE, 3))
+        pool.shutdown()
+
+    def test_failed_after_retries(self):
+        def handler(file):
+            raise OSError('device gone')
+        self.config.move_retries = 1
+        pool = plexformatter.MoveWorkerPool(self.config, self.logger, handler)
+        finished = []
+        pool.on_finished = finished.append
+        file = self.create_file('a.mkv')
+        pool.submit(file)
+        self.assertTrue(pool.join(5))
+        self.assertEqual((file.state, file.attempts), (plexformatter.MoveState.FAILED, 2))
+        self.assertListEqual(finished, [file])
+        pool.shutdown()
+
+    def test_retry_now_skips_backoff(self):
+        def handler(file):
+            calls.append(file.attempts)
+            if len(calls) == 1:
+                raise OSError('volume missing')
+        calls = []
+        self.config.move_retry_delay = 60
+        pool = plexformatter.MoveWorkerPool(self.config, self.logger, handler)
+        file = self.create_file('a.rar')
+        pool.submit(file)
+        deadline = time.time() + 5
+        while file.src_path not in pool.timers and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(pool.retry_now(file.src_path))
+        self.assertTrue(pool.join(5), 'retry waited for the backoff')
+        self.assertEqual(file.state, plexformatter.MoveState.DONE)
+        self.assertFalse(pool.retry_now(file.src_path))
+        pool.shutdown()
+
+    def test_moves_per_device_limit(self):
+        def handler(file):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            time.sleep(0.02)
+            with self.lock:
+                self.running -= 1
+        self.config.move_workers = 4
+        self.config.moves_per_device = 1
+        pool = plexformatter.MoveWorkerPool(self.config, self.logger, handler)
+        files = [self.create_file(f'{index}.mkv') for index in range(4)]
+        for file in files:
+            pool.submit(file)
+        self.assertTrue(pool.join(5))
+        self.assertEqual(self.peak, 1, 'per device limit was exceeded')
+        self.assertTrue(all(file.state == plexformatter.MoveState.DONE for file in files))
+        pool.shutdown()
+
+    def test_small_files_first(self):
+        order = []
+        started = threading.Event()
+        release = threading.Event()
+        def handler(file):
+            order.append(os.path.basename(file.src_path))
+            started.set()
+            release.wait(5)
+        self.config.moves_per_device = 1
+        self.config.small_file_size = 5
+        temp_directory = tempfile.mkdtemp()
+        pool = plexformatter.MoveWorkerPool(self.config, self.logger, handler)
+        pool.submit(self.create_file('first.mkv'))
+        started.wait(5)
+        for name, size in (('remux.mkv', 10), ('episode.mkv', 4), ('subtitle.srt', 1)):
+            file = self.create_file(name)
+            file.src_path = os.path.join(temp_directory, name)
+            with open(file.src_path, 'wb') as data:
+                data.write(b'a' * size)
+            pool.submit(file)
+        release.set()
+        self.assertTrue(pool.join(5))
+        self.assertListEqual(order, ['first.mkv', 'episode.mkv', 'subtitle.srt', 'remux.mkv'])
+        pool.shutdown()
+        shutil.rmtree(temp_directory)
+
+class IOSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = plexformatter.FormatterConfig()
+        self.config.transfer_rate_limit = 10 * 1024 * 1024
+        self.config.transfer_rate_profiles = [{'start': '23:00', 'end': '07:00', 'rate': 0},
+                                              {'start': '18:00', 'end': '23:00', 'rate': 1024 * 1024}]
+
+    def at(self, hour: int, minute: int = 0) -> float:
+        return time.mktime(time.localtime()[:3] + (hour, minute, 0, 0, 0, -1))
+
+    def test_time_of_day_profiles(self):
+        scheduler = plexformatter.IOScheduler(self.config)
+        self.assertEqual(scheduler.limit(self.at(2, 30)), 0, 'profile across midnight was not applied')
+        self.assertEqual(scheduler.limit(self.at(23, 30)), 0)
+        self.assertEqual(scheduler.limit(self.at(20)), 1024 * 1024)
+        self.assertEqual(scheduler.limit(self.at(12)), 10 * 1024 * 1024)
+        self.config.transfer_rate_profiles = [{'start': '25:00', 'end': '07:00', 'rate': 0}]
+        self.assertRaises(ValueError, plexformatter.IOScheduler, self.config)
+
+    def test_bandwidth_cap(self):
+        self.config.transfer_rate_profiles = []
+        scheduler = plexformatter.IOScheduler(self.config)
+        chunk_size = scheduler.chunk_size(64 * 1024 * 1024)
+        self.assertEqual(chunk_size, 10 * 1024 * 1024 // 4, 'chunks were not reduced under a cap')
+        start = time.perf_counter()
+        for _ in range(12):
+            scheduler.consume(256 * 1024)
+        self.assertGreater(time.perf_counter() - start, 0.25, 'transfers were not throttled')
+        self.assertGreater(scheduler.throttled_seconds, 0)
+        self.assertEqual(scheduler.transferred, 3 * 1024 * 1024)
+
+    def test_unlimited(self):
+        self.config.transfer_rate_limit = 0
+        self.config.transfer_rate_profiles = []
+        scheduler = plexformatter.IOScheduler(self.config)
+        start = time.perf_counter()
+        scheduler.consume(1024 * 1024 * 1024)
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertEqual(scheduler.throughput(), 1024 * 1024 * 1024 / scheduler.window)
+
+class EventCoalescerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.coalescer = plexformatter.EventCoalescer(window=60)
+
+    def flush(self) -> list[tuple[str, str]]:
+        self.coalescer.flush(force=True)
+        batch = self.coalescer.batches.get_nowait()
+        return sorted((event.event_type, event.src_path) for event in batch)
+
+    def test_burst_is_coalesced(self):
+        self.coalescer.dispatch(FileCreatedEvent('/watch/a.mkv'))
+        for _ in range(100):
+            self.coalescer.dispatch(FileModifiedEvent('/watch/a.mkv'))
+            self.coalescer.dispatch(FileModifiedEvent('/watch/b.mkv'))
+        self.assertListEqual(self.flush(), [('created', '/watch/a.mkv'), ('modified', '/watch/b.mkv')])
+        self.assertDictEqual(self.coalescer.stats(), {'raw_events': 201, 'coalesced_events': 2, 'batches': 1})
+
+    def test_transient_file_is_dropped(self):
+        self.coalescer.dispatch(FileCreatedEvent('/watch/a.mkv'))
+        self.coalescer.dispatch(FileModifiedEvent('/watch/a.mkv'))
+        self.coalescer.dispatch(FileDeletedEvent('/watch/a.mkv'))
+        self.assertEqual(self.coalescer.flush(force=True), 0)
+
+    def test_close_is_kept(self):
+        self.coalescer.dispatch(FileCreatedEvent('/watch/a.mkv'))
+        self.coalescer.dispatch(FileClosedEvent('/watch/a.mkv'))
+        self.coalescer.dispatch(FileClosedEvent('/watch/b.mkv'))
+        self.assertListEqual(self.flush(), [('closed', '/watch/a.mkv'), ('closed', '/watch/b.mkv'), ('created', '/watch/a.mkv')])
+
+    def test_move_becomes_delete_and_create(self):
+        self.coalescer.dispatch(FileCreatedEvent('/watch/a.mkv.part'))
+        self.coalescer.dispatch(FileMovedEvent('/watch/a.mkv.part', '/watch/a.mkv'))
+        self.assertListEqual(self.flush(), [('created', '/watch/a.mkv')])
+
+    def test_window(self):
+        self.coalescer.dispatch(FileModifiedEvent('/watch/a.mkv'))
+        self.assertEqual(self.coalescer.flush(), 0, 'event was flushed before the window elapsed')
 
 class DaemonTestCase(unittest.TestCase):
     def setUp(self):
         self.logger = logging.getLogger(__name__)
-        handler = logging.FileHandler(os.path.abspath('./daemontest.log'))
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-        handler.setLevel(logging.DEBUG)
-        self.logger.addHandler(handler)
+        self.handler = logging.FileHandler(os.path.abspath('./daemontest.log'))
+        self.handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        self.handler.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
         self.config = plexformatter.FormatterConfig()
         self.root_folder = os.path.abspath('./daemon_test/')
         self.config.misc_destination_directory = os.path.join(self.root_folder, 'misc/')
@@ -123,7 +908,10 @@ class DaemonTestCase(unittest.TestCase):
         self.daemon.delay_before_moving = 0
     
     def tearDown(self):
+        self.daemon.move_pool.shutdown()
         shutil.rmtree(os.path.abspath(self.root_folder))
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
     
     def test_find_files(self):
         self.daemon.find_files(self.config.watch_directory)
@@ -131,6 +919,15 @@ class DaemonTestCase(unittest.TestCase):
         correct_files = {'alien 1979.mp4', 'stranger things s01e01.mp4', 'test.mp4', 'test', 'test.txt'}
         self.assertSetEqual(found_files, correct_files, 'Failed to find files')
     
+    def test_find_files_deduplicates_events(self):
+        self.daemon.find_files(self.config.watch_directory)
+        file_path = os.path.join(self.config.watch_directory, 'test.mp4')
+        self.daemon.coalescer.dispatch(FileCreatedEvent(file_path))
+        self.daemon.coalescer.dispatch(FileModifiedEvent(file_path))
+        self.daemon.coalescer.flush(force=True)
+        self.daemon.process_events(timeout=0)
+        self.assertEqual(len(self.daemon.tracked_files), 5, 'file was tracked twice')
+
     def test_move_file(self):
         self.daemon.find_files(self.config.watch_directory)
         for file in self.daemon.tracked_files:
@@ -146,10 +943,20 @@ class DaemonTestCase(unittest.TestCase):
         self.assertListEqual(dir_contents, correct_dir_contents, 'failed to move all files correctly')
         
     
+    def test_move_duplicate_file(self):
+        self.daemon.find_files(self.config.watch_directory)
+        file = self.daemon.tracked_files.get(os.path.join(self.config.watch_directory, 'test.mp4'))
+        with open(file.dest_path, 'w+') as existing:
+            existing.write('test')
+        self.daemon.move_file(file)
+        self.assertFalse(os.path.exists(file.src_path), 'duplicate download was left in the watch folder')
+        self.assertEqual(self.daemon.duplicate_resolver.duplicates, 1)
+
     def test_check_tracked_files(self):
         self.daemon.find_files(self.config.watch_directory)
         time.sleep(0.01)
         self.daemon.check_tracked_files()
+        self.assertTrue(self.daemon.move_pool.join(5), 'moves did not finish')
         dir_contents = [os.listdir(path) for path in [self.config.watch_directory,
                         self.config.misc_destination_directory,
                         os.path.join(self.config.movie_destination_directory, 'Alien (1979)'),
@@ -177,6 +984,38 @@ class DaemonTestCase(unittest.TestCase):
                                 'test.mp4']
         self.assertListEqual(os.listdir(self.config.watch_directory), correct_dir_contents, 'failed to clean watch folder')
 
+class WatchFolderSweeperTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root_folder = tempfile.mkdtemp()
+        for path in ['a/b/c', 'd/e', 'f']:
+            os.makedirs(os.path.join(self.root_folder, path))
+        with open(os.path.join(self.root_folder, 'd', 'e', 'file.mkv'), 'w+') as file:
+            file.write('test')
+        self.sweeper = plexformatter.WatchFolderSweeper(self.root_folder + '/')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_folder)
+
+    def test_sweep(self):
+        empty_directories = {os.path.join(self.root_folder, 'a'), os.path.join(self.root_folder, 'f')}
+        self.assertSetEqual(set(self.sweeper.sweep()), empty_directories)
+        scans = self.sweeper.scans
+        self.assertSetEqual(set(self.sweeper.sweep()), empty_directories)
+        self.assertEqual(self.sweeper.scans, scans, 'unchanged folders were scanned again')
+
+    def test_sweep_revisits_dirty_directories(self):
+        self.sweeper.sweep()
+        scans = self.sweeper.scans
+        file_path = os.path.join(self.root_folder, 'a', 'b', 'c', 'file.mkv')
+        with open(file_path, 'w+') as file:
+            file.write('test')
+        self.sweeper.mark_dirty(file_path)
+        self.assertListEqual(self.sweeper.sweep(), [os.path.join(self.root_folder, 'f')])
+        self.assertEqual(self.sweeper.scans, scans + 1, 'only the changed folder should be scanned')
+        os.remove(os.path.join(self.root_folder, 'd', 'e', 'file.mkv'))
+        self.sweeper.mark_dirty(os.path.join(self.root_folder, 'd', 'e', 'file.mkv'))
+        self.assertSetEqual(set(self.sweeper.sweep()), {os.path.join(self.root_folder, 'd'), os.path.join(self.root_folder, 'f')})
+
 class DaemonHandlersTestCase(unittest.TestCase):
     def setUp(self):
         self.logger = logging.getLogger(__name__)
@@ -218,17 +1057,20 @@ class DaemonHandlersTestCase(unittest.TestCase):
         shutil.rmtree(self.root_folder)
     
     def test_on_modified(self):
-        self.daemon.add_file(os.path.join(self.config.watch_directory, 'Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4'))
-        self.daemon.add_file(os.path.join(self.watch_nested_directory, 'test2.mp4'))
-        initial_time_0 = self.daemon.tracked_files[0].last_modification
-        initial_time_1 = self.daemon.tracked_files[0].last_modification
+        file_path_0 = os.path.join(self.config.watch_directory, 'Alien.1979.PROPER.REMASTERED.THEATRICAL.1080p.BluRay.x265-RARBG.mp4')
+        file_path_1 = os.path.join(self.watch_nested_directory, 'test2.mp4')
+        self.daemon.add_file(file_path_0)
+        self.daemon.add_file(file_path_1)
+        initial_time_0 = self.daemon.tracked_files.get(file_path_0).last_modification
+        initial_time_1 = self.daemon.tracked_files.get(file_path_1).last_modification
         time.sleep(0.1)
-        with open(self.daemon.tracked_files[0].src_path, 'w+') as file:
+        with open(file_path_0, 'w+') as file:
             file.write('testing testing')
-        with open(self.daemon.tracked_files[1].src_path, 'w+') as file:
+        with open(file_path_1, 'w+') as file:
             file.write('testing testing')
-        self.assertNotEqual(self.daemon.tracked_files[0].last_modification, initial_time_0, 'failed to detect modified file')
-        self.assertNotEqual(self.daemon.tracked_files[1].last_modification, initial_time_1, 'failed to detect modified file recursively')
+        time.sleep(0.1)
+        self.assertNotEqual(self.daemon.tracked_files.get(file_path_0).last_modification, initial_time_0, 'failed to detect modified file')
+        self.assertNotEqual(self.daemon.tracked_files.get(file_path_1).last_modification, initial_time_1, 'failed to detect modified file recursively')
     
     def test_on_created(self):
         os.mkdir(os.path.join(self.config.watch_directory, 'test_deeper'))
@@ -246,10 +1088,427 @@ class DaemonHandlersTestCase(unittest.TestCase):
 
     
     def test_signal_handler(self):
-        pass
+        # the handler runs on whatever the main thread was doing, it must not wait on the locks that code holds
+        with self.daemon.journal.lock:
+            thread = threading.Thread(target=self.daemon.signal_handler, args=(signal.SIGTERM, None))
+            thread.start()
+            thread.join(1)
+            self.assertFalse(thread.is_alive(), 'signal handler waited on the journal lock')
+        self.assertTrue(self.daemon.stopping.is_set())
     
     def test_start(self):
         pass
 
+class StartupTestCase(unittest.TestCase):
+    cold_start_budget = 0.25
+
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.temp_directory = tempfile.mkdtemp()
+        self.config = plexformatter.FormatterConfig()
+        self.config.watch_directory = self.temp_directory
+        self.config.movie_destination_directory = os.path.join(self.temp_directory, 'movie')
+        self.config.misc_destination_directory = self.temp_directory
+        self.config.show_destination_directory = self.temp_directory
+        self.config.non_video_destination_directory = self.temp_directory
+        self.config.stability_quiet_time = 0
+        self.daemon = plexformatter.Daemon(self.config, plexformatter.FileFormatter(self.config, self.logger), self.logger)
+
+    def tearDown(self):
+        self.daemon.move_pool.shutdown()
+        shutil.rmtree(self.temp_directory)
+
+    def test_parser_cold_start(self):
+        script = ('import sys, time\n'
+                  'start = time.perf_counter()\n'
+                  'import plexformatter\n'
+                  "plexformatter.FileFormatter(plexformatter.FormatterConfig(), None).resolve('Alien.1979.1080p.mp4')\n"
+                  "print(time.perf_counter() - start, ' '.join({'watchdog', 'sqlite3', 'asyncio'} & sys.modules.keys()))\n")
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(plexformatter.__file__))).stdout.split()
+        self.assertEqual(output[1:], [], 'parser-only use imported daemon dependencies')
+        self.assertLess(float(output[0]), self.cold_start_budget, 'cold start is over budget')
+
+    def test_events_without_watchdog(self):
+        file_path = os.path.join(self.temp_directory, 'test.mp4')
+        with open(file_path, 'w+') as file:
+            file.write('test')
+        self.daemon.dispatch(plexformatter.FileSystemEvent('created', file_path))
+        self.assertIn(file_path, self.daemon.tracked_files)
+        self.daemon.dispatch(plexformatter.FileSystemEvent('opened', file_path))
+        self.daemon.dispatch(plexformatter.FileSystemEvent('deleted', file_path))
+        self.assertNotIn(file_path, self.daemon.tracked_files)
+
+    def test_moves_wait_for_missing_destination(self):
+        file_path = os.path.join(self.temp_directory, 'Alien.1979.mp4')
+        with open(file_path, 'w+') as file:
+            file.write('test')
+        start = time.time()
+        self.daemon.wait_for_paths()
+        self.assertLess(time.time() - start, 1, 'startup blocked on a missing destination')
+        self.daemon.add_file(file_path)
+        file = self.daemon.tracked_files.get(file_path)
+        file.next_check = 0
+        self.daemon.tracked_files.reschedule(file)
+        self.daemon.check_tracked_files()
+        self.assertIn(file_path, self.daemon.tracked_files, 'file was moved into a missing destination')
+        os.mkdir(self.config.movie_destination_directory)
+        self.daemon.check_paths(force=True)
+        self.assertEqual(self.daemon.missing_paths, [])
+        file.next_check = 0
+        self.daemon.tracked_files.reschedule(file)
+        self.daemon.check_tracked_files()
+        self.assertTrue(self.daemon.move_pool.join(5))
+        self.assertTrue(os.path.exists(file.dest_path))
+
+    def test_setup_logger(self):
+        self.config.log_location = self.temp_directory
+        logger = plexformatter.setup_logger(self.config)
+        try:
+            logger.info('started')
+            logger.setLevel(logging.DEBUG)
+            logger.debug('reloaded')
+        finally:
+            for handler in logger.handlers[:]:
+                logger.removeHandler(handler)
+                handler.close()
+        with open(os.path.join(self.temp_directory, 'file_formatter.log')) as log:
+            text = log.read()
+        self.assertIn('started', text)
+        self.assertIn('reloaded', text, 'raised log level did not reach the log file')
+
+    def test_main_runs_until_sigterm(self):
+        path = os.path.join(self.temp_directory, 'plexformatter.toml')
+        log_path = os.path.join(self.temp_directory, 'file_formatter.log')
+        with open(path, 'w') as file:
+            file.write(f"watch_directory = '{self.temp_directory}'\nlog_location = '{self.temp_directory}'\n"
+                       f"misc_destination_directory = '{self.temp_directory}'\n")
+        def read_log() -> str:
+            if not os.path.exists(log_path):
+                return ''
+            with open(log_path) as log:
+                return log.read()
+        process = subprocess.Popen([sys.executable, os.path.abspath(plexformatter.__file__), '-c', path])
+        try:
+            deadline = time.time() + 10
+            while time.time() < deadline and 'Daemon started' not in read_log():
+                time.sleep(0.05)
+            process.send_signal(signal.SIGTERM)
+            self.assertEqual(process.wait(10), 0)
+        finally:
+            process.kill()
+        self.assertIn('Daemon started', read_log(), 'daemon did not start')
+
+class ArchiveExtractorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.temp_directory = tempfile.mkdtemp()
+        self.config = plexformatter.FormatterConfig()
+        self.config.watch_directory = os.path.join(self.temp_directory, 'watch')
+        for name in ('show', 'movie', 'misc', 'non_video'):
+            setattr(self.config, f'{name}_destination_directory', os.path.join(self.temp_directory, name))
+        self.config.stability_quiet_time = 0
+        os.mkdir(self.config.watch_directory)
+        self.daemon = plexformatter.Daemon(self.config, plexformatter.FileFormatter(self.config, self.logger), self.logger)
+
+    def tearDown(self):
+        self.daemon.move_pool.shutdown()
+        self.daemon.extraction_pool.shutdown()
+        shutil.rmtree(self.temp_directory)
+
+    def create_zip(self, name: str, members: dict) -> str:
+        path = os.path.join(self.config.watch_directory, name)
+        with zipfile.ZipFile(path, 'w') as archive:
+            for member, data in members.items():
+                archive.writestr(member, data)
+        return path
+
+    def test_archive_volume(self):
+        volumes = {'Show.S01E01.rar': True, 'Show.S01E01.r00': False, 'Show.S01E01.part01.rar': True,
+                   'Show.S01E01.part2.rar': False, 'Show.S01E01.ZIP': True}
+        for name, first in volumes.items():
+            self.assertEqual(plexformatter.archive_volume(os.path.join('/watch', name)), ('/watch/show.s01e01', first), name)
+        self.assertIsNone(plexformatter.archive_volume('/watch/Show.S01E01.mkv'))
+        self.assertIsNone(plexformatter.archive_volume('/watch/Show.S01E01.part01.zip'))
+        self.assertIsNone(plexformatter.archive_volume('/watch/Show.S01E01.z01'), 'split zips cannot be extracted')
+
+    def test_extract_video(self):
+        path = self.create_zip('Alien.1979.1080p.BluRay.zip', {'abc123.mkv': b'movie', 'Sample/abc123-sample.mkv': b'sample',
+                                                               'alien.nfo': b'info'})
+        self.daemon.add_file(path)
+        file = self.daemon.tracked_files.get(path)
+        file.next_check = 0
+        self.daemon.tracked_files.reschedule(file)
+        self.daemon.check_tracked_files()
+        self.assertTrue(self.daemon.extraction_pool.join(5), 'extraction did not finish')
+        movie_directory = os.path.join(self.config.movie_destination_directory, 'Alien (1979)')
+        self.assertListEqual(os.listdir(movie_directory), ['Alien (1979).mkv'], 'video was not named after the release')
+        with open(os.path.join(movie_directory, 'Alien (1979).mkv'), 'rb') as movie:
+            self.assertEqual(movie.read(), b'movie')
+        self.assertFalse(os.path.exists(path), 'archive was left in the watch folder')
+        self.assertFalse(os.path.exists(self.config.non_video_destination_directory))
+
+    def test_skips_videos_already_extracted(self):
+        self.daemon.duplicate_resolver.index.block_size = 16
+        path = self.create_zip('Alien.1979.1080p.BluRay.zip', {'abc123.mkv': b'a' * 100})
+        dest_path = os.path.join(self.config.movie_destination_directory, 'Alien (1979)', 'Alien (1979).mkv')
+        self.assertEqual(self.daemon.archive_extractor.extract(path), [dest_path])
+        self.assertEqual(self.daemon.archive_extractor.extract(path), [], 'identical video was extracted again')
+        self.assertEqual(self.daemon.duplicate_resolver.duplicates, 1)
+        self.daemon.duplicate_resolver.policy = 'version'
+        path = self.create_zip('Alien.1979.1080p.BluRay.zip', {'abc123.mkv': b'a' * 50 + b'b' * 50})
+        self.assertEqual(self.daemon.archive_extractor.extract(path),
+                         [os.path.join(os.path.dirname(dest_path), 'Alien (1979) (2).mkv')])
+
+    def test_unreadable_archive_is_moved(self):
+        lead = os.path.join(self.config.watch_directory, 'Show.S01E01.720p.zip')
+        volume = os.path.join(self.config.watch_directory, 'Show.S01E01.720p.z01')
+        for path in (lead, volume):
+            with open(path, 'wb') as file:
+                file.write(b'not a zip')
+            self.daemon.add_file(path)
+            file = self.daemon.tracked_files.get(path)
+            file.next_check = 0
+            self.daemon.tracked_files.reschedule(file)
+        self.daemon.check_tracked_files()
+        self.assertTrue(self.daemon.extraction_pool.join(5), 'extraction did not finish')
+        self.assertTrue(self.daemon.move_pool.join(5))
+        self.assertListEqual(os.listdir(self.config.watch_directory), [], 'archive was stranded in the watch folder')
+        self.assertListEqual(sorted(os.listdir(self.config.non_video_destination_directory)),
+                             ['show s01e01.z01', 'show s01e01.zip'])
+
+    def test_retries_first_volume_when_set_completes(self):
+        def extract(path):
+            raise OSError('volume missing')
+        self.daemon.archive_extractor.extract = extract
+        lead = os.path.join(self.config.watch_directory, 'Show.S01E01.rar')
+        volume = os.path.join(self.config.watch_directory, 'Show.S01E01.r00')
+        files = []
+        for path in (lead, volume):
+            with open(path, 'wb') as file:
+                file.write(b'rar')
+            self.daemon.add_file(path)
+            files.append(self.daemon.tracked_files.get(path))
+            self.daemon.tracked_files.remove(path)
+        self.daemon.extraction_pool.max_retries = 0
+        self.daemon.submit_file(files[0])
+        deadline = time.time() + 5
+        while not self.daemon.failed_archives and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(files[0].state, plexformatter.MoveState.FAILED)
+        self.assertIs(self.daemon.submit_file(files[1]), files[0])
+        self.assertIn(lead, self.daemon.tracked_files, 'first volume was stranded after the set completed')
+
+    def test_waits_for_all_volumes(self):
+        lead = os.path.join(self.config.watch_directory, 'Show.S01E01.rar')
+        volume = os.path.join(self.config.watch_directory, 'Show.S01E01.r00')
+        for path in (lead, volume):
+            with open(path, 'wb') as file:
+                file.write(b'rar')
+            self.daemon.add_file(path)
+        self.daemon.tracked_files.get(volume).next_check = time.time() + 60
+        file = self.daemon.tracked_files.get(lead)
+        file.next_check = 0
+        self.daemon.tracked_files.reschedule(file)
+        self.daemon.check_tracked_files()
+        self.assertIn(lead, self.daemon.tracked_files, 'archive was extracted before the set was complete')
+        self.assertEqual(len(self.daemon.extraction_pool), 0)
+
+    def test_archive_without_video_is_moved(self):
+        path = self.create_zip('Soundtrack.zip', {'01.flac': b'music'})
+        file = plexformatter.TrackedFile()
+        file.src_path = path
+        self.daemon.extract_archive(file)
+        self.assertListEqual(os.listdir(self.config.non_video_destination_directory), ['soundtrack.zip'])
+
+class DaemonGroupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.temp_directory = tempfile.mkdtemp()
+        self.config = plexformatter.FormatterConfig()
+        self.config.misc_destination_directory = os.path.join(self.temp_directory, 'misc')
+        self.fast_root = os.path.join(self.temp_directory, 'fast')
+        self.slow_root = os.path.join(self.temp_directory, 'slow')
+        self.slow_misc_directory = os.path.join(self.temp_directory, 'slow_misc')
+        self.config.watch_roots = [
+            plexformatter.WatchRoot(self.fast_root),
+            plexformatter.WatchRoot(self.slow_root, misc_destination_directory=self.slow_misc_directory,
+                                    stability_quiet_time=120),
+        ]
+        for directory in (self.fast_root, self.slow_root):
+            os.mkdir(directory)
+            with open(os.path.join(directory, 'test.mp4'), 'w+') as file:
+                file.write('test')
+        self.group = plexformatter.DaemonGroup(self.config, self.logger)
+        self.fast, self.slow = (self.group.daemon_for(os.path.join(root, 'test.mp4')) for root in (self.fast_root, self.slow_root))
+
+    def tearDown(self):
+        for daemon in self.group.daemons:
+            daemon.move_pool.shutdown()
+        shutil.rmtree(self.temp_directory)
+
+    def test_root_overrides(self):
+        self.assertIsNot(self.fast, self.slow)
+        self.assertEqual(self.slow.delay_before_moving, 120)
+        self.assertEqual(self.fast.delay_before_moving, self.config.stability_quiet_time)
+        self.assertIs(self.fast.file_formatter.cache, self.slow.file_formatter.cache, 'parse cache is not shared')
+        self.config.watch_roots.append(plexformatter.WatchRoot(self.fast_root, misc_destination=''))
+        self.assertRaises(AttributeError, self.config.root_configs)
+
+    def test_shared_metrics_counted_once(self):
+        self.config.transfer_rate_limit = 1000
+        self.group.io_scheduler.configure(self.config)
+        self.group.io_scheduler.throttled_seconds = 1.5
+        for daemon in self.group.daemons:
+            daemon.start_metrics()
+        try:
+            self.fast.file_formatter.resolve('test.mp4')
+            lines = plexformatter.METRICS.render().splitlines()
+        finally:
+            for daemon in self.group.daemons:
+                daemon.stop_metrics()
+        self.assertIn('plexformatter_parse_cache_misses_total 1', lines)
+        self.assertIn('plexformatter_transfer_rate_limit_bytes 1000', lines)
+        self.assertIn('plexformatter_throttled_seconds_total 1.5', lines)
+
+    def test_signal_handler(self):
+        with self.fast.journal.lock:
+            thread = threading.Thread(target=self.group.signal_handler, args=(signal.SIGTERM, None))
+            thread.start()
+            thread.join(1)
+            self.assertFalse(thread.is_alive(), 'signal handler waited on a daemon lock')
+        self.assertTrue(self.group.stopping.is_set())
+
+    def test_nested_root_is_left_to_its_daemon(self):
+        inner_root = os.path.join(self.fast_root, 'usenet', 'complete')
+        os.makedirs(inner_root)
+        file_path = os.path.join(inner_root, 'Alien.1979.mkv')
+        with open(file_path, 'w+') as file:
+            file.write('test')
+        self.config.watch_roots.append(plexformatter.WatchRoot(inner_root))
+        group = plexformatter.DaemonGroup(self.config, self.logger)
+        try:
+            outer, inner = (group.daemon_for(os.path.join(root, 'test.mp4')) for root in (self.fast_root, inner_root))
+            for daemon in group.daemons:
+                daemon.find_files(daemon.config.watch_directory)
+            self.assertIn(file_path, inner.tracked_files)
+            self.assertNotIn(file_path, outer.tracked_files, 'outer root tracked a file of the nested root')
+            self.assertFalse(outer.owns(file_path))
+            os.remove(file_path)
+            outer.clean_watch_folder()
+            self.assertTrue(os.path.isdir(inner_root), 'outer root swept the nested root away')
+        finally:
+            for daemon in group.daemons:
+                daemon.move_pool.shutdown()
+
+    def test_routes_files_per_root(self):
+        for daemon in self.group.daemons:
+            daemon.find_files(daemon.config.watch_directory)
+        self.assertEqual(self.fast.tracked_files.get(os.path.join(self.fast_root, 'test.mp4')).dest_path,
+                         os.path.join(self.config.misc_destination_directory, 'test.mp4'))
+        self.assertEqual(self.slow.tracked_files.get(os.path.join(self.slow_root, 'test.mp4')).dest_path,
+                         os.path.join(self.slow_misc_directory, 'test.mp4'))
+
+    def test_shared_event_queue(self):
+        file_path = os.path.join(self.slow_root, 'new.mp4')
+        with open(file_path, 'w+') as file:
+            file.write('test')
+        self.slow.coalescer.dispatch(FileCreatedEvent(file_path))
+        self.slow.coalescer.flush(force=True)
+        self.group.process_events(timeout=0)
+        self.assertIn(file_path, self.slow.tracked_files)
+        self.assertEqual(len(self.fast.tracked_files), 0)
+
+class BatchImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.root_folder = tempfile.mkdtemp()
+        self.config = plexformatter.FormatterConfig()
+        self.import_directory = os.path.join(self.root_folder, 'import')
+        self.config.show_destination_directory = os.path.join(self.root_folder, 'show')
+        self.config.movie_destination_directory = os.path.join(self.root_folder, 'movie')
+        self.config.misc_destination_directory = os.path.join(self.root_folder, 'misc')
+        self.config.non_video_destination_directory = os.path.join(self.root_folder, 'misc')
+        os.makedirs(os.path.join(self.import_directory, 'Show.S01'))
+        for name in ['Alien.1979.1080p.mp4', 'readme.txt', os.path.join('Show.S01', 'Show.S01E01.720p.mkv'),
+                     os.path.join('Show.S01', 'Show.S01E02.720p.mkv')]:
+            with open(os.path.join(self.import_directory, name), 'w+') as file:
+                file.write('test')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_folder)
+
+    def test_dry_run(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            plan = plexformatter.BatchImporter(self.config, self.logger, workers=2, chunk_size=1).run(self.import_directory, dry_run=True)
+        self.assertSetEqual({(os.path.basename(src_path), action) for src_path, _, action in plan},
+                            {('Alien.1979.1080p.mp4', 'move'), ('readme.txt', 'delete'),
+                             ('Show.S01E01.720p.mkv', 'move'), ('Show.S01E02.720p.mkv', 'move')})
+        self.assertIn('planned 4 files', output.getvalue())
+        self.assertEqual(len(list(plexformatter.iter_files(self.import_directory))), 4, 'dry run touched files')
+
+    def test_run(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            plexformatter.BatchImporter(self.config, self.logger, workers=1).run(self.import_directory)
+        self.assertListEqual(list(plexformatter.iter_files(self.import_directory)), [])
+        self.assertListEqual(sorted(os.listdir(os.path.join(self.config.show_destination_directory, 'Show', 'Season 01'))),
+                             ['Show - s01e01.mkv', 'Show - s01e02.mkv'])
+        self.assertTrue(os.path.exists(os.path.join(self.config.movie_destination_directory, 'Alien (1979)', 'Alien (1979).mp4')))
+
+class AsyncRuntimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.root_folder = tempfile.mkdtemp()
+        self.config = plexformatter.FormatterConfig()
+        for name in ['watch', 'show', 'movie', 'misc']:
+            os.mkdir(os.path.join(self.root_folder, name))
+        self.config.watch_directory = os.path.join(self.root_folder, 'watch')
+        self.config.show_destination_directory = os.path.join(self.root_folder, 'show')
+        self.config.movie_destination_directory = os.path.join(self.root_folder, 'movie')
+        self.config.misc_destination_directory = os.path.join(self.root_folder, 'misc')
+        self.config.non_video_destination_directory = os.path.join(self.root_folder, 'misc')
+        self.config.log_location = self.root_folder
+        with open(os.path.join(self.config.watch_directory, 'Alien.1979.1080p.mp4'), 'w+') as file:
+            file.write('test')
+        self.daemon = plexformatter.Daemon(self.config, plexformatter.FileFormatter(self.config, self.logger), self.logger)
+        self.daemon.delay_before_moving = 0.2
+        self.runtime = plexformatter.AsyncRuntime(self.daemon)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_folder)
+
+    def test_run(self):
+        moved_path = os.path.join(self.config.show_destination_directory, 'Show', 'Season 01', 'Show - s01e02.mkv')
+        def writer():
+            time.sleep(0.3)
+            os.mkdir(os.path.join(self.config.watch_directory, 'Show'))
+            with open(os.path.join(self.config.watch_directory, 'Show', 'Show.S01E02.mkv'), 'w+') as file:
+                file.write('test')
+            for _ in range(100):
+                if os.path.exists(moved_path) and not os.path.exists(os.path.join(self.config.watch_directory, 'Show')):
+                    break
+                time.sleep(0.05)
+            self.runtime.stop()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        asyncio.run(self.runtime.run())
+        thread.join()
+        self.assertTrue(os.path.exists(moved_path), 'new file was not moved')
+        self.assertTrue(os.path.exists(os.path.join(self.config.movie_destination_directory, 'Alien (1979)', 'Alien (1979).mp4')),
+                        'file found at startup was not moved')
+        self.assertListEqual(os.listdir(self.config.watch_directory), [], 'watch folder was not cleaned')
+
+    def test_check_file_submits_once(self):
+        self.daemon.delay_before_moving = 0
+        self.daemon.find_files(self.config.watch_directory)
+        file = self.daemon.tracked_files.get(os.path.join(self.config.watch_directory, 'Alien.1979.1080p.mp4'))
+        file.next_check = 0
+        self.assertListEqual(self.runtime.check_file(file), [])
+        self.assertListEqual(self.runtime.check_file(file), [], 'overlapping check submitted the file twice')
+        self.assertTrue(self.daemon.move_pool.join(5))
+        self.assertEqual(file.state, plexformatter.MoveState.DONE)
+        self.daemon.move_pool.shutdown()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file